@@ -0,0 +1,296 @@
+import sys
+import argparse
+
+
+
+#Headless command line for cron jobs and systemd timers, run with python -m apod
+# Everything here is built on get_apod and never imports PyQt5.  The heavier modules are
+# imported inside the commands so --help and argument errors return straight away.
+#
+#   python -m apod fetch --today | --random | --date 2024-01-01
+#   python -m apod set-wallpaper --random
+#   python -m apod prefetch --range 2024-01-01 2024-12-31 [--images]
+#   python -m apod mirror FOLDER --range 1995-06-16 2024-12-31 [--workers 8] [--verify]
+#   python -m apod search ring nebula [--images]
+#   python -m apod index [--sizes]              (sizes for --random --min-width/--landscape)
+#   python -m apod score [--workers 4]          (wallpaper scores that weight --random)
+#   python -m apod daily --mode random      (run every few minutes from a timer)
+
+
+
+def pick_date(args):
+    import get_apod
+
+    if args.date:
+        return args.date
+    if args.random:
+        return get_apod.get_daily_image("random", args.min_width, args.min_height, args.landscape)
+    return get_apod.get_daily_image("current")
+
+
+
+#The image for a date, or the best cached one when NASA can't be reached
+# Returns (date, path, metadata, stale), stale is True when a cached image stands in.
+def fetch_image(date, mode="current", hd=True):
+    import get_apod
+
+    try:
+        data = get_apod.get_image_metadata(date)
+        return date, get_apod.get_image_file(data, hd=hd), data, False
+    except get_apod.ApodError as e:
+        if not get_apod.is_unavailable(e):
+            raise
+        found = get_apod.find_cached_image(date, mode)
+        if found is None:
+            raise
+        print(f"offline ({e}), using the cached image for {found[0]}", file=sys.stderr)
+        return found + (True,)
+
+
+
+def cmd_fetch(args):
+    date, path, data, stale = fetch_image(pick_date(args), "random" if args.random else "current", hd=not args.sd)
+    print(f"{date}\t{path}\t{data['title']}")
+    return 0
+
+
+
+#The desktop gets the store's current file, a file in the image cache can be evicted under it
+def cmd_set_wallpaper(args):
+    import image_store
+    import wallpaper
+
+    date, path, data, stale = fetch_image(pick_date(args), "random" if args.random else "current")
+    path = image_store.set_current(path, date)
+    wallpaper.get_backend(args.backend).set_wallpaper(path)
+    print(f"{date}\t{path}\t{data['title']}")
+    return 0
+
+
+
+def cmd_prefetch(args):
+    import get_apod
+
+    start, end = args.range
+    records = 0
+    images = 0
+    for data in get_apod.get_apod_range(start, end):
+        records += 1
+        if args.images and data.get('media_type') == 'image':
+            get_apod.get_image_file(data)
+            images += 1
+    print(f"{records} records, {images} images")
+    return 0
+
+
+
+def cmd_search(args):
+    import get_apod
+
+    results = get_apod.search_apod(" ".join(args.query), args.limit, args.images, sync=not args.no_sync)
+    for result in results:
+        print(f"{result['date']}\t{result['media_type']}\t{result['title']}")
+    return 0
+
+
+
+#Bring the image index up to date, and read the size of images that haven't been downloaded
+def cmd_index(args):
+    import get_apod
+
+    synced = get_apod.sync_image_index()
+    print(f"{synced} new dates indexed")
+    if args.sizes:
+        def progress(done, total):
+            print(f"  {done} of {total} images", file=sys.stderr)
+
+        found = get_apod.probe_image_sizes(args.limit, progress)
+        print(f"{found} image sizes read")
+    return 0
+
+
+
+#Score the cached images as wallpapers, or print the stored features of some dates
+# Decoding happens in scoring's worker processes, this process still never imports PyQt5.
+def cmd_score(args):
+    import time
+    import record_store
+    import scoring
+
+    if args.show is not None:
+        store = record_store.get_store()
+        for date in args.show:
+            print(date, store.features(date))
+        return 0
+
+    start = time.perf_counter()
+    scored = scoring.score_cached(args.workers, args.limit)
+    elapsed = time.perf_counter() - start
+    print(f"{scored} images scored in {elapsed:.1f}s ({scored / elapsed if elapsed else 0:.1f} images/s)")
+    return 0
+
+
+
+def cmd_mirror(args):
+    import mirror
+
+    start, end = args.range
+
+    def progress(stats):
+        done = stats.fetched + stats.skipped
+        if done % 100 == 0:
+            print(f"  {done} images, {stats.mb_per_s:.1f} MB/s", file=sys.stderr)
+
+    stats = mirror.sync_mirror(args.folder, start, end, args.workers, hd=not args.sd,
+                               verify=args.verify, progress=progress)
+    print(stats.summary())
+    for date in stats.failed:
+        print(f"failed {date}")
+    return 1 if stats.failed else 0
+
+
+
+#One step of the daily schedule, apply the update if it is due, otherwise prefetch the next one
+def cmd_daily(args):
+    from datetime import datetime
+
+    import get_apod
+    import image_store
+    import scheduler
+    import wallpaper
+
+    schedule = scheduler.DailySchedule(args.time)
+    now = datetime.now()
+
+    if schedule.is_due(now):
+        requested = schedule.take(args.mode, now) or get_apod.get_daily_image(args.mode)
+        date, path, data, stale = fetch_image(requested, args.mode)
+        path = image_store.set_current(path, date)
+        wallpaper.get_backend(args.backend).set_wallpaper(path)
+        schedule.mark_applied(now, stand_in=requested if stale else None)
+        print(f"applied {'cached ' if stale else ''}{date}\t{path}")
+        now = datetime.now()
+    elif schedule.stand_in:
+        # The last update used a cached image, apply the real one once NASA can be reached
+        try:
+            data = get_apod.get_image_metadata(schedule.stand_in)
+            path = image_store.set_current(get_apod.get_image_file(data), data['date'])
+        except get_apod.ApodError as e:
+            if not get_apod.is_unavailable(e):
+                schedule.mark_applied(now)
+            print(f"still offline: {e}")
+        else:
+            wallpaper.get_backend(args.backend).set_wallpaper(path)
+            schedule.mark_applied(now)
+            print(f"applied {data['date']}\t{path}")
+
+    if schedule.prefetch_due(args.mode, now):
+        try:
+            date = schedule.prefetch(args.mode, now)
+        except get_apod.ApodError as e:
+            print(f"prefetch not ready: {e}")
+        else:
+            print(f"prefetched {date}")
+    else:
+        print(f"next update {schedule.next_run(now):%Y-%m-%d %H:%M}")
+    return 0
+
+
+
+def add_date_options(parser):
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument("--date", help="APOD date, YYYY-MM-DD")
+    group.add_argument("--random", action="store_true", help="a random image from the archive")
+    group.add_argument("--today", action="store_true", help="today's APOD (the default)")
+    # Sizes are known for downloaded images, "index --sizes" reads the rest
+    parser.add_argument("--min-width", type=int, default=0, help="with --random, only images at least this wide")
+    parser.add_argument("--min-height", type=int, default=0, help="with --random, only images at least this tall")
+    parser.add_argument("--landscape", action="store_true", help="with --random, only landscape images")
+
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="python -m apod", description="NASA Astronomy Picture of the Day, without the GUI.")
+    parser.add_argument("--stats", action="store_true", help="print per-stage timings when done")
+    parser.add_argument("-v", "--verbose", action="store_true", help="log each pipeline stage")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    fetch = commands.add_parser("fetch", help="download an image into the cache and print its path")
+    add_date_options(fetch)
+    fetch.add_argument("--sd", action="store_true", help="the standard resolution image instead of HD")
+    fetch.set_defaults(handler=cmd_fetch)
+
+    set_wallpaper = commands.add_parser("set-wallpaper", help="fetch an image and make it the wallpaper")
+    add_date_options(set_wallpaper)
+    set_wallpaper.add_argument("--backend", help="windows, gnome or stub (default: from the platform)")
+    set_wallpaper.set_defaults(handler=cmd_set_wallpaper)
+
+    prefetch = commands.add_parser("prefetch", help="load the metadata (and images) for a date range")
+    prefetch.add_argument("--range", nargs=2, metavar=("START", "END"), required=True)
+    prefetch.add_argument("--images", action="store_true", help="also download the HD images")
+    prefetch.set_defaults(handler=cmd_prefetch)
+
+    mirror = commands.add_parser("mirror", help="download every image of a date range into a folder")
+    mirror.add_argument("folder")
+    mirror.add_argument("--range", nargs=2, metavar=("START", "END"), required=True)
+    mirror.add_argument("--workers", type=int, default=8, help="concurrent downloads")
+    mirror.add_argument("--sd", action="store_true", help="the standard resolution images instead of HD")
+    mirror.add_argument("--verify", action="store_true", help="hash every mirrored file again")
+    mirror.set_defaults(handler=cmd_mirror)
+
+    search = commands.add_parser("search", help="search the titles and explanations of the archive")
+    search.add_argument("query", nargs="+")
+    search.add_argument("--limit", type=int, default=20)
+    search.add_argument("--images", action="store_true", help="only list image days")
+    search.add_argument("--no-sync", action="store_true", help="search what is indexed without asking the API")
+    search.set_defaults(handler=cmd_search)
+
+    index = commands.add_parser("index", help="update the image index used for random picks")
+    index.add_argument("--sizes", action="store_true", help="also read the size of images that haven't been downloaded")
+    index.add_argument("--limit", type=int, help="read at most this many sizes")
+    index.set_defaults(handler=cmd_index)
+
+    score = commands.add_parser("score", help="score the cached images as wallpapers for random picks")
+    score.add_argument("--workers", type=int, help="processes to use (default: one per CPU core)")
+    score.add_argument("--limit", type=int, help="score at most this many images")
+    score.add_argument("--show", nargs="*", metavar="DATE", help="print the stored features of these dates")
+    score.set_defaults(handler=cmd_score)
+
+    daily = commands.add_parser("daily", help="run the daily schedule once, for cron or a systemd timer")
+    daily.add_argument("--mode", choices=("current", "random"), default="current")
+    daily.add_argument("--time", help="update time HH:MM, saved for later runs")
+    daily.add_argument("--backend", help="windows, gnome or stub (default: from the platform)")
+    daily.set_defaults(handler=cmd_daily)
+
+    return parser
+
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+
+    import logging
+    import sqlite3
+    import instrument
+    import get_apod
+    from wallpaper import WallpaperError
+
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING,
+                        format="%(asctime)s %(name)s %(levelname)s %(message)s")
+    if args.stats or args.verbose:
+        instrument.enable()
+
+    try:
+        status = args.handler(args)
+    except (get_apod.ApodError, WallpaperError, ValueError, OSError, sqlite3.Error) as e:
+        print(f"error: {e}", file=sys.stderr)
+        status = 1
+
+    if args.stats:
+        print(instrument.format_stats())
+    return status
+
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,165 @@
+import os
+import json
+import hashlib
+import threading
+import tempfile
+from urllib.parse import urlparse
+
+
+
+# Default size budget for cached images, can be overridden with APOD_CACHE_MAX_MB
+DEFAULT_MAX_MB = 1024
+# Screen-fitted wallpaper renditions get their own, smaller budget
+RENDITIONS_MAX_MB = 200
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+_evict_lock = threading.Lock()
+
+
+
+#Folder that holds the cache, can be overridden with APOD_CACHE_DIR
+def cache_dir():
+    path = os.getenv("APOD_CACHE_DIR")
+    if path:
+        return path
+
+    if os.name == "nt":
+        base = os.getenv("LOCALAPPDATA") or os.path.expanduser("~")
+    else:
+        base = os.getenv("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "apod_wallpaper")
+
+
+
+#Disk budget for the images folder in bytes
+def max_bytes():
+    try:
+        megabytes = float(os.getenv("APOD_CACHE_MAX_MB", DEFAULT_MAX_MB))
+    except ValueError:
+        megabytes = DEFAULT_MAX_MB
+    return int(megabytes * 1024 * 1024)
+
+
+
+def metadata_path(date):
+    return os.path.join(cache_dir(), "metadata", f"{date}.json")
+
+
+
+#Images are named by date, keeping the extension of the original url
+# The standard resolution version of an image is stored with an "_sd" suffix
+def image_path(date, image_url, hd=True):
+    ext = os.path.splitext(urlparse(image_url).path)[1].lower() or ".jpg"
+    suffix = "" if hd else "_sd"
+    return os.path.join(cache_dir(), "images", f"{date}{suffix}{ext}")
+
+
+
+#Write to a temp file in the same folder and rename it into place,
+# so readers never see a half-written file
+def atomic_write(path, data):
+    folder = os.path.dirname(path)
+    os.makedirs(folder, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=folder, suffix=".tmp")
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+
+#SHA-256 of a file as a hex string, read in chunks so large images aren't held in memory
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+
+#Metadata JSON of versions before the record store, only read to import it into the store
+def load_metadata(date):
+    try:
+        with open(metadata_path(date), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+
+#Scaled previews are kept next to the image they were made from
+# The name carries the size and inode of the image, which change when it is downloaded again
+# but not when touch() moves it up the LRU order.
+def preview_path(image_path, width):
+    stat = os.stat(image_path)
+    return f"{os.path.splitext(image_path)[0]}.preview{width}_{stat.st_size:x}_{stat.st_ino:x}.jpg"
+
+
+
+#Return the path of the cached image, or None if the image is not cached
+def find_image(date, image_url, hd=True):
+    path = image_path(date, image_url, hd)
+    if not os.path.isfile(path):
+        return None
+
+    touch(path)
+    return path
+
+
+
+#Mark a cached file as recently used, the mtime is used as the LRU clock
+def touch(path):
+    try:
+        os.utime(path, None)
+    except OSError:
+        pass
+
+
+
+#Wallpaper renditions are named by date, size in pixels, fit mode and the source they were made from
+def rendition_path(date, size_key, fit_mode, source_key):
+    return os.path.join(cache_dir(), "renditions", f"{date}_{size_key}_{fit_mode}_{source_key}.jpg")
+
+
+
+#Delete the least recently used files until the cache folder fits the budget
+def evict(budget=None, keep=(), folder="images"):
+    if budget is None:
+        budget = max_bytes()
+    folder = os.path.join(cache_dir(), folder)
+    keep = {os.path.abspath(path) for path in keep}
+
+    with _evict_lock:
+        entries = []
+        total = 0
+        try:
+            with os.scandir(folder) as it:
+                for entry in it:
+                    if not entry.is_file():
+                        continue
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+                    total += stat.st_size
+        except FileNotFoundError:
+            return 0
+
+        removed = 0
+        entries.sort()
+        for mtime, size, path in entries:
+            if total <= budget:
+                break
+            if os.path.abspath(path) in keep:
+                continue
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            removed += 1
+        return removed
@@ -0,0 +1,186 @@
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import tracemalloc
+from datetime import datetime, timedelta
+
+import get_apod
+import instrument
+from fake_apod_server import FakeApodServer
+
+
+
+#Benchmarks for the fetch/display pipeline, run against fake_apod_server so they need no network
+# Each benchmark gets an empty cache folder.  Results print as a table, --json writes them for
+# comparing runs, for example: python bench_apod.py --json bench_output.json
+
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, max(0, round(fraction * (len(ordered) - 1))))
+    return ordered[index]
+
+
+
+#Point get_apod at a fresh cache folder, returns the folder so it can be removed afterwards
+def fresh_cache():
+    folder = tempfile.mkdtemp(prefix="apod_bench_")
+    os.environ["APOD_CACHE_DIR"] = folder
+    return folder
+
+
+
+def bench_lookup(server, dates):
+    cold = []
+    for date in dates:
+        start = time.perf_counter()
+        get_apod.get_apod_image_file(date)
+        cold.append(time.perf_counter() - start)
+
+    server.reset_counters()
+    warm = []
+    for date in dates:
+        start = time.perf_counter()
+        get_apod.get_apod_image_file(date)
+        warm.append(time.perf_counter() - start)
+
+    return {
+        "cold_p50_ms": percentile(cold, 0.5) * 1000,
+        "cold_p95_ms": percentile(cold, 0.95) * 1000,
+        "warm_p50_ms": percentile(warm, 0.5) * 1000,
+        "warm_p95_ms": percentile(warm, 0.95) * 1000,
+        "warm_network_requests": server.api_requests + server.image_requests,
+    }
+
+
+
+def bench_range(server, days):
+    end = datetime.today() - timedelta(days=1)
+    start = end - timedelta(days=days - 1)
+    server.reset_counters()
+    began = time.perf_counter()
+    count = sum(1 for _ in get_apod.get_apod_range(start, end))
+    elapsed = time.perf_counter() - began
+    return {
+        "records": count,
+        "seconds": elapsed,
+        "records_per_s": count / elapsed if elapsed else 0.0,
+        "api_requests": server.api_requests,
+    }
+
+
+
+#Peak Python heap while downloading one image, and the time to decode its preview
+def bench_image(server, date):
+    # Generate the synthetic image up front so it isn't counted in the client's time and memory
+    server.image(server.image_size)
+    server.reset_counters()
+    tracemalloc.start()
+    start = time.perf_counter()
+    path, title, caption = get_apod.get_apod_image_file(date)
+    download = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    result = {
+        "file_bytes": os.path.getsize(path),
+        "download_ms": download * 1000,
+        "download_peak_heap_kb": peak / 1024,
+        "mb_per_s": server.bytes_sent / download / 1e6 if download else 0.0,
+    }
+
+    try:
+        from workers import decode_preview
+    except ImportError:
+        return result
+    start = time.perf_counter()
+    decode_preview(path)
+    result["preview_decode_ms"] = (time.perf_counter() - start) * 1000
+    # Look the image up again first, the cache hit touches it just like showing the date again does
+    path = get_apod.get_apod_image_file(date)[0]
+    start = time.perf_counter()
+    decode_preview(path)
+    result["preview_cached_ms"] = (time.perf_counter() - start) * 1000
+    return result
+
+
+
+def run(args):
+    results = {"lookup": {}, "range": {}, "image": {}}
+    sizes = [tuple(int(part) for part in size.lower().split("x")) for size in args.sizes]
+    end = datetime.today() - timedelta(days=1)
+
+    with FakeApodServer(image_size=sizes[0], image_format=args.format, latency=args.latency,
+                        failure_rate=args.failure_rate, video_every=0) as server:
+        get_apod.set_api_base(server.api_base)
+
+        server.image(server.image_size)
+        folder = fresh_cache()
+        dates = [(end - timedelta(days=i)).strftime('%Y-%m-%d') for i in range(args.lookups)]
+        results["lookup"] = bench_lookup(server, dates)
+        shutil.rmtree(folder, ignore_errors=True)
+
+        folder = fresh_cache()
+        results["range"] = bench_range(server, args.range_days)
+        shutil.rmtree(folder, ignore_errors=True)
+
+        for width, height in sizes:
+            server.image_size = (width, height)
+            folder = fresh_cache()
+            results["image"][f"{width}x{height}"] = bench_image(server, end.strftime('%Y-%m-%d'))
+            shutil.rmtree(folder, ignore_errors=True)
+
+    return results
+
+
+
+def print_results(results):
+    print("Lookup latency (get_apod_image_file)")
+    for key, value in results["lookup"].items():
+        print(f"  {key:<24}{value:>12.2f}")
+    print("Range prefetch (get_apod_range)")
+    for key, value in results["range"].items():
+        print(f"  {key:<24}{value:>12.2f}")
+    print("Per image size")
+    for size, values in results["image"].items():
+        print(f"  {size}")
+        for key, value in values.items():
+            print(f"    {key:<22}{value:>12.2f}")
+
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the APOD fetch/display pipeline against a local fake server.")
+    parser.add_argument("--lookups", type=int, default=20, help="dates for the cold/warm lookup benchmark")
+    parser.add_argument("--range-days", type=int, default=365, help="length of the range prefetch")
+    parser.add_argument("--sizes", nargs="+", default=["1024x768", "4000x3000", "8000x6000"],
+                        help="HD image sizes to measure, WIDTHxHEIGHT")
+    parser.add_argument("--format", choices=("png", "jpg"), default="jpg")
+    parser.add_argument("--latency", type=float, default=0.02, help="seconds the fake server adds to each request")
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args(argv)
+
+    # JPEG images and preview decoding need Qt, run it without a display
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    instrument.enable()
+    results = run(args)
+    results["stages"] = instrument.stats()
+    print_results(results)
+    print("Pipeline stages")
+    print(instrument.format_stats())
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+
+
+
+if __name__ == "__main__":
+    sys.exit(main())
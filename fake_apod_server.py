@@ -0,0 +1,266 @@
+import sys
+import json
+import time
+import zlib
+import random
+import struct
+import argparse
+import threading
+from datetime import datetime, timedelta
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+
+
+# Same archive start as get_apod, kept here so the server doesn't import the client
+APOD_START_DATE = datetime(1995, 6, 16)
+API_PATH = "/planetary/apod"
+
+
+
+#Stand-in for the NASA APOD API and image host, for benchmarks and offline testing
+# Serves recorded metadata (a JSON list of APOD records) or generated records, and synthetic
+# images of a configurable size.  Every request can be delayed by latency seconds and fails
+# with a 503 and Retry-After at failure_rate.  Image downloads support Range requests.
+# Point the client at it with get_apod.set_api_base(server.api_base) or APOD_API_BASE.
+class FakeApodServer:
+    def __init__(self, host="127.0.0.1", port=0, image_size=(4000, 3000), sd_size=(960, 720),
+                 image_format="png", latency=0.0, failure_rate=0.0, records=None, video_every=7,
+                 rate_limit=1000, seed=0):
+        self.image_size = image_size
+        self.sd_size = sd_size
+        self.image_format = image_format
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.video_every = video_every
+        self.rate_limit = rate_limit
+        self.random = random.Random(seed)
+        self.records = {record['date']: record for record in records or []}
+        self.lock = threading.Lock()
+        self.images = {}
+        # Counters for the benchmarks
+        self.api_requests = 0
+        self.image_requests = 0
+        self.bytes_sent = 0
+
+        handler = type("Handler", (_Handler,), {"server_state": self})
+        self.httpd = ThreadingHTTPServer((host, port), handler)
+        self.httpd.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def api_base(self):
+        return self.url + API_PATH
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def reset_counters(self):
+        with self.lock:
+            self.api_requests = 0
+            self.image_requests = 0
+            self.bytes_sent = 0
+
+    def should_fail(self):
+        with self.lock:
+            return self.random.random() < self.failure_rate
+
+    #Recorded record for the date, or a generated one with every video_every-th day a video
+    def record(self, date, base_url):
+        if date in self.records:
+            return self.records[date]
+        day = (datetime.strptime(date, '%Y-%m-%d') - APOD_START_DATE).days
+        if self.video_every and day % self.video_every == self.video_every - 1:
+            return {'date': date, 'media_type': 'video', 'title': f"Video {date}",
+                    'explanation': f"Synthetic video entry for {date}.",
+                    'url': f"{base_url}/video/{date}.mp4"}
+        ext = "jpg" if self.image_format == "jpg" else "png"
+        return {'date': date, 'media_type': 'image', 'title': f"Synthetic APOD {date}",
+                'explanation': f"Synthetic image for {date}, {self.image_size[0]}x{self.image_size[1]} pixels.",
+                'url': f"{base_url}/image/{date}_sd.{ext}", 'hdurl': f"{base_url}/image/{date}.{ext}"}
+
+    #Encoded image bytes for a size, generated once and shared by every date
+    def image(self, size):
+        with self.lock:
+            data = self.images.get(size)
+            if data is None:
+                data = synthetic_image(size[0], size[1], self.image_format)
+                self.images[size] = data
+            return data
+
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server_state = None
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        state = self.server_state
+        if state.latency:
+            time.sleep(state.latency)
+
+        if state.should_fail():
+            self.send_json(503, {'msg': "Synthetic failure"}, {"Retry-After": "0"})
+            return
+
+        url = urlparse(self.path)
+        if url.path == API_PATH:
+            with state.lock:
+                state.api_requests += 1
+                remaining = max(0, state.rate_limit - state.api_requests)
+            self.api(parse_qs(url.query), {"X-RateLimit-Limit": str(state.rate_limit),
+                                           "X-RateLimit-Remaining": str(remaining)})
+        elif url.path.startswith("/image/"):
+            with state.lock:
+                state.image_requests += 1
+            size = state.sd_size if "_sd." in url.path else state.image_size
+            self.send_image(state.image(size))
+        else:
+            self.send_json(404, {'msg': "Not found"})
+
+    def api(self, query, headers):
+        state = self.server_state
+        base_url = f"http://{self.headers.get('Host')}"
+        today = datetime.today()
+        try:
+            if 'start_date' in query:
+                start = datetime.strptime(query['start_date'][0], '%Y-%m-%d')
+                end = datetime.strptime(query.get('end_date', [today.strftime('%Y-%m-%d')])[0], '%Y-%m-%d')
+                if start < APOD_START_DATE or end > today or start > end:
+                    raise ValueError
+                dates = [(start + timedelta(days=i)).strftime('%Y-%m-%d') for i in range((end - start).days + 1)]
+                self.send_json(200, [state.record(date, base_url) for date in dates], headers)
+            else:
+                date = query.get('date', [today.strftime('%Y-%m-%d')])[0]
+                if not APOD_START_DATE <= datetime.strptime(date, '%Y-%m-%d') <= today:
+                    raise ValueError
+                self.send_json(200, state.record(date, base_url), headers)
+        except ValueError:
+            self.send_json(400, {'code': 400, 'msg': "Date must be between Jun 16, 1995 and today."}, headers)
+
+    def send_json(self, status, data, headers=None):
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_image(self, data):
+        start = 0
+        status = 200
+        range_header = self.headers.get("Range", "")
+        if range_header.startswith("bytes="):
+            first, _, last = range_header[6:].partition("-")
+            start = int(first or 0)
+            end = min(int(last), len(data) - 1) if last else len(data) - 1
+            if start >= len(data):
+                self.send_response(416)
+                self.send_header("Content-Range", f"bytes */{len(data)}")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            status = 206
+        else:
+            end = len(data) - 1
+
+        body = memoryview(data)[start:end + 1]
+        self.send_response(status)
+        self.send_header("Content-Type", "image/jpeg" if data[:2] == b'\xff\xd8' else "image/png")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("Accept-Ranges", "bytes")
+        if status == 206:
+            self.send_header("Content-Range", f"bytes {start}-{end}/{len(data)}")
+        self.end_headers()
+        try:
+            self.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            return
+        with self.server_state.lock:
+            self.server_state.bytes_sent += len(body)
+
+
+
+#Encode a width x height noise image, noise keeps the file close to a real photo's size
+# PNG is written directly, JPEG needs PyQt5.
+def synthetic_image(width, height, image_format="png"):
+    rng = random.Random(width * 100003 + height)
+    # One random row repeated with a shift keeps generation fast for large sizes
+    row = bytes(rng.getrandbits(8) for _ in range(width * 3 + 256))
+
+    if image_format == "jpg":
+        from PyQt5.QtCore import QBuffer, QByteArray, QIODevice
+        from PyQt5.QtGui import QImage
+
+        pixels = b''.join(row[y % 256:y % 256 + width * 3] for y in range(height))
+        image = QImage(pixels, width, height, width * 3, QImage.Format_RGB888)
+        buffer_data = QByteArray()
+        buffer = QBuffer(buffer_data)
+        buffer.open(QIODevice.WriteOnly)
+        image.save(buffer, "JPG", 90)
+        return bytes(buffer_data)
+
+    raw = b''.join(b'\x00' + row[y % 256:y % 256 + width * 3] for y in range(height))
+
+    def chunk(kind, data):
+        return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data) & 0xFFFFFFFF)
+
+    return (b'\x89PNG\r\n\x1a\n'
+            + chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0))
+            + chunk(b'IDAT', zlib.compress(raw, 1))
+            + chunk(b'IEND', b''))
+
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve a fake NASA APOD API for testing and benchmarks.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--size", default="4000x3000", help="HD image size, WIDTHxHEIGHT")
+    parser.add_argument("--format", choices=("png", "jpg"), default="png")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every request")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="fraction of requests answered with 503")
+    parser.add_argument("--records", help="JSON file with a list of recorded APOD records")
+    args = parser.parse_args(argv)
+
+    records = None
+    if args.records:
+        with open(args.records, 'r', encoding='utf-8') as f:
+            records = json.load(f)
+    width, height = (int(part) for part in args.size.lower().split("x"))
+
+    server = FakeApodServer(args.host, args.port, (width, height), image_format=args.format,
+                            latency=args.latency, failure_rate=args.failure_rate, records=records)
+    print(f"Fake APOD API at {server.api_base}, set APOD_API_BASE to use it")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    server.httpd.server_close()
+
+
+
+if __name__ == "__main__":
+    sys.exit(main())
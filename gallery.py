@@ -0,0 +1,331 @@
+from collections import OrderedDict
+from datetime import datetime
+
+from PyQt5.QtWidgets import (QDialog, QVBoxLayout, QHBoxLayout, QLabel, QPushButton, QDateEdit,
+                             QListView, QAbstractItemView)
+from PyQt5.QtGui import QPixmap, QColor, QPainter
+from PyQt5.QtCore import (Qt, QObject, QRunnable, QThreadPool, QAbstractListModel, QModelIndex,
+                          QSize, QDate, pyqtSignal)
+
+import get_apod
+from workers import decode_preview
+
+
+
+THUMB_WIDTH = 160
+THUMB_HEIGHT = 120
+# Most thumbnails kept as pixmaps, older ones are decoded again from the cached preview file
+PIXMAP_CACHE_SIZE = 300
+# Records are sent to the model in batches of this size as the range loads
+RECORD_BATCH = 60
+
+
+
+class RangeLoaderSignals(QObject):
+    records = pyqtSignal(int, object)
+    failed = pyqtSignal(int, str)
+    finished = pyqtSignal(int)
+
+
+
+#Load the metadata for a date range off the GUI thread, in batches as get_apod_range yields them
+class RangeLoader(QRunnable):
+    def __init__(self, generation, start_date, end_date):
+        super().__init__()
+        self.generation = generation
+        self.start_date = start_date
+        self.end_date = end_date
+        self.cancelled = False
+        self.signals = RangeLoaderSignals()
+
+    def cancel(self):
+        self.cancelled = True
+
+    def run(self):
+        batch = []
+        try:
+            for data in get_apod.get_apod_range(self.start_date, self.end_date):
+                if self.cancelled:
+                    return
+                batch.append(data)
+                if len(batch) >= RECORD_BATCH:
+                    self.signals.records.emit(self.generation, batch)
+                    batch = []
+        except get_apod.ApodError as e:
+            if batch:
+                self.signals.records.emit(self.generation, batch)
+            self.signals.failed.emit(self.generation, str(e))
+            return
+        if batch:
+            self.signals.records.emit(self.generation, batch)
+        self.signals.finished.emit(self.generation)
+
+
+
+class ThumbnailSignals(QObject):
+    finished = pyqtSignal(object, object)
+
+
+
+#Download the small url image of one date and decode it at thumbnail size
+# A loader for a cell that has scrolled out of view is cancelled before it downloads anything.
+class ThumbnailLoader(QRunnable):
+    def __init__(self, data):
+        super().__init__()
+        self.data = data
+        self.cancelled = False
+        self.signals = ThumbnailSignals()
+
+    def cancel(self):
+        self.cancelled = True
+
+    def run(self):
+        image = None
+        if not self.cancelled:
+            try:
+                path = get_apod.get_image_file(self.data, hd=False)
+                if not self.cancelled:
+                    image = decode_preview(path, THUMB_WIDTH)
+            except (get_apod.ApodError, OSError):
+                image = None
+        self.signals.finished.emit(self, image)
+
+
+
+#List model over the records of a range
+# The view only asks for the decoration of cells it paints, so only visible thumbnails are
+# loaded.  Decoded thumbnails live in a bounded LRU of pixmaps.
+class GalleryModel(QAbstractListModel):
+    def __init__(self, thread_pool, parent=None):
+        super().__init__(parent)
+        self.thread_pool = thread_pool
+        self.records = []
+        self.rows = {}
+        self.pixmaps = OrderedDict()
+        self.pending = {}
+        self.failed = set()
+        self.placeholder = self.make_placeholder("Loading...")
+        self.video_placeholder = self.make_placeholder("Video")
+        self.error_placeholder = self.make_placeholder("No image")
+
+    def make_placeholder(self, text):
+        pixmap = QPixmap(THUMB_WIDTH, THUMB_HEIGHT)
+        pixmap.fill(QColor(40, 40, 48))
+        painter = QPainter(pixmap)
+        painter.setPen(QColor(200, 200, 200))
+        painter.drawText(pixmap.rect(), Qt.AlignCenter, text)
+        painter.end()
+        return pixmap
+
+    def clear(self):
+        self.beginResetModel()
+        for loader in self.pending.values():
+            loader.cancel()
+        self.records = []
+        self.rows = {}
+        self.pending = {}
+        self.failed = set()
+        self.endResetModel()
+
+    def add_records(self, records):
+        first = len(self.records)
+        self.beginInsertRows(QModelIndex(), first, first + len(records) - 1)
+        for row, data in enumerate(records, first):
+            self.rows[data['date']] = row
+        self.records.extend(records)
+        self.endInsertRows()
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.records)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        data = self.records[index.row()]
+        if role == Qt.DisplayRole:
+            return data['date']
+        if role == Qt.ToolTipRole:
+            return data.get('title', "")
+        if role == Qt.UserRole:
+            return data
+        if role == Qt.DecorationRole:
+            return self.thumbnail(data)
+        return None
+
+    def thumbnail(self, data):
+        date = data['date']
+        if data.get('media_type') != 'image':
+            return self.video_placeholder
+        if date in self.failed:
+            return self.error_placeholder
+
+        pixmap = self.pixmaps.get(date)
+        if pixmap is not None:
+            self.pixmaps.move_to_end(date)
+            return pixmap
+
+        if date not in self.pending:
+            loader = ThumbnailLoader(data)
+            loader.signals.finished.connect(self.thumbnail_loaded)
+            self.pending[date] = loader
+            self.thread_pool.start(loader)
+        return self.placeholder
+
+    def thumbnail_loaded(self, loader, image):
+        date = loader.data['date']
+        # A cancelled loader may finish after a new one was started for the same cell
+        if self.pending.get(date) is not loader:
+            return
+        del self.pending[date]
+        if image is None:
+            self.failed.add(date)
+        else:
+            self.pixmaps[date] = QPixmap.fromImage(image)
+            while len(self.pixmaps) > PIXMAP_CACHE_SIZE:
+                self.pixmaps.popitem(last=False)
+        index = self.index(self.rows[date])
+        self.dataChanged.emit(index, index, [Qt.DecorationRole])
+
+    #Cancel the loaders of cells that are no longer on screen
+    def keep_only(self, first_row, last_row):
+        for date, loader in list(self.pending.items()):
+            row = self.rows.get(date)
+            if row is None or not first_row <= row <= last_row:
+                loader.cancel()
+                del self.pending[date]
+
+
+
+#Scrollable grid of thumbnails for a date range, double click a cell to show that date
+class GalleryDialog(QDialog):
+    date_selected = pyqtSignal(str)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle("APOD Gallery")
+        self.resize(880, 700)
+
+        self.thread_pool = QThreadPool(self)
+        self.thread_pool.setMaxThreadCount(4)
+        self.generation = 0
+        self.range_loader = None
+
+        self.start_edit = QDateEdit(self)
+        self.start_edit.setDisplayFormat("yyyy-MM-dd")
+        self.start_edit.setCalendarPopup(True)
+        self.end_edit = QDateEdit(self)
+        self.end_edit.setDisplayFormat("yyyy-MM-dd")
+        self.end_edit.setCalendarPopup(True)
+        first = QDate(get_apod.APOD_START_DATE.year, get_apod.APOD_START_DATE.month, get_apod.APOD_START_DATE.day)
+        for edit in (self.start_edit, self.end_edit):
+            edit.setDateRange(first, QDate.currentDate())
+        self.end_edit.setDate(QDate.currentDate())
+        self.start_edit.setDate(QDate.currentDate().addMonths(-1))
+
+        self.show_button = QPushButton("Show")
+        self.show_button.clicked.connect(self.load_range)
+        self.status_label = QLabel("")
+
+        self.model = GalleryModel(self.thread_pool, self)
+        self.view = QListView(self)
+        self.view.setViewMode(QListView.IconMode)
+        self.view.setResizeMode(QListView.Adjust)
+        self.view.setMovement(QListView.Static)
+        self.view.setUniformItemSizes(True)
+        self.view.setLayoutMode(QListView.Batched)
+        self.view.setBatchSize(200)
+        self.view.setIconSize(QSize(THUMB_WIDTH, THUMB_HEIGHT))
+        self.view.setGridSize(QSize(THUMB_WIDTH + 20, THUMB_HEIGHT + 40))
+        self.view.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        self.view.setModel(self.model)
+        self.view.doubleClicked.connect(self.item_activated)
+        self.view.verticalScrollBar().valueChanged.connect(self.scrolled)
+        self.view.verticalScrollBar().rangeChanged.connect(self.scrolled)
+
+        controls = QHBoxLayout()
+        controls.addWidget(QLabel("From:"))
+        controls.addWidget(self.start_edit)
+        controls.addWidget(QLabel("To:"))
+        controls.addWidget(self.end_edit)
+        controls.addWidget(self.show_button)
+        controls.addWidget(self.status_label, 1)
+
+        layout = QVBoxLayout()
+        layout.addLayout(controls)
+        layout.addWidget(self.view)
+        self.setLayout(layout)
+
+    def load_range(self):
+        if self.range_loader is not None:
+            self.range_loader.cancel()
+        self.model.clear()
+
+        start = self.start_edit.date().toString("yyyy-MM-dd")
+        end = self.end_edit.date().toString("yyyy-MM-dd")
+        if start > end:
+            start, end = end, start
+
+        self.generation += 1
+        self.range_loader = RangeLoader(self.generation, datetime.strptime(start, '%Y-%m-%d'),
+                                        datetime.strptime(end, '%Y-%m-%d'))
+        self.range_loader.signals.records.connect(self.records_loaded)
+        self.range_loader.signals.failed.connect(self.range_failed)
+        self.range_loader.signals.finished.connect(self.range_finished)
+        self.thread_pool.start(self.range_loader)
+        self.status_label.setText("Loading...")
+
+    def records_loaded(self, generation, records):
+        if generation == self.generation:
+            self.model.add_records(records)
+            self.status_label.setText(f"{self.model.rowCount()} days")
+
+    def range_failed(self, generation, message):
+        if generation == self.generation:
+            self.range_loader = None
+            self.status_label.setText(message)
+
+    def range_finished(self, generation):
+        if generation == self.generation:
+            self.range_loader = None
+            self.status_label.setText(f"{self.model.rowCount()} days")
+
+    def resizeEvent(self, event):
+        super().resizeEvent(event)
+        self.scrolled()
+
+    #Rows currently on screen, from the position of the first cell and the grid size
+    # indexAt on the corners of the viewport lands in the spacing between cells, so the rows
+    # are worked out from the grid instead.  Returns (0, -1) when nothing is laid out yet.
+    def visible_rows(self):
+        count = self.model.rowCount()
+        first_rect = self.view.visualRect(self.model.index(0))
+        if count == 0 or not first_rect.isValid():
+            return 0, -1
+
+        columns = 1
+        while columns < count and self.view.visualRect(self.model.index(columns)).top() == first_rect.top():
+            columns += 1
+        grid_height = self.view.gridSize().height()
+        viewport = self.view.viewport().rect()
+        first_line = max(0, (viewport.top() - first_rect.top()) // grid_height)
+        last_line = max(0, (viewport.bottom() - first_rect.top()) // grid_height)
+        return first_line * columns, min(count - 1, (last_line + 1) * columns - 1)
+
+    #Drop the thumbnail requests of cells scrolled past, also run after layout and resizes
+    def scrolled(self):
+        self.model.keep_only(*self.visible_rows())
+
+    #Image dates of the loaded range, in order, for the wallpaper rotation
+    def image_dates(self):
+        return [data['date'] for data in self.model.records if data.get('media_type') == 'image']
+
+    def item_activated(self, index):
+        data = self.model.data(index, Qt.UserRole)
+        if data is not None and data.get('media_type') == 'image':
+            self.date_selected.emit(data['date'])
+
+    def closeEvent(self, event):
+        if self.range_loader is not None:
+            self.range_loader.cancel()
+        self.model.keep_only(0, -1)
+        super().closeEvent(event)
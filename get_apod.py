@@ -1,61 +1,815 @@
 import requests
+from requests.adapters import HTTPAdapter
 import random
-from datetime import datetime, timedelta
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+from datetime import datetime, timedelta, timezone
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlparse
 
 from dotenv import load_dotenv
 import os
 
+import apod_cache
+import image_index
+import instrument
+import record_store
+import search_index
+
 
 
 load_dotenv()
 api_key = os.getenv("NASA_API_KEY")
 
-API_URL = f"https://api.nasa.gov/planetary/apod?api_key={api_key}"
+# The API endpoint can be pointed somewhere else, such as the fake server, with APOD_API_BASE
+API_BASE = os.getenv("APOD_API_BASE", "https://api.nasa.gov/planetary/apod")
+API_URL = f"{API_BASE}?api_key={api_key}"
 
 
 
-def get_apod_image(date):
+#Point the client at a different APOD endpoint, for example fake_apod_server for benchmarks
+def set_api_base(base_url):
+    global API_BASE, API_URL
+    API_BASE = base_url.rstrip("/")
+    API_URL = f"{API_BASE}?api_key={api_key}"
+
+
+# HTTP client settings, the timeouts and retry count can be overridden from the environment
+CONNECT_TIMEOUT = float(os.getenv("APOD_CONNECT_TIMEOUT", "5"))
+READ_TIMEOUT = float(os.getenv("APOD_READ_TIMEOUT", "30"))
+# Single date lookups answer in well under a second, so the window doesn't wait long on a stalled server
+LOOKUP_READ_TIMEOUT = float(os.getenv("APOD_LOOKUP_READ_TIMEOUT", "10"))
+MAX_RETRIES = int(os.getenv("APOD_MAX_RETRIES", "4"))
+POOL_SIZE = 8
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 30
+# A Retry-After longer than this is treated as a hard failure instead of blocking the caller
+RETRY_AFTER_MAX = 60
+RETRY_STATUS = {429, 500, 502, 503, 504}
+# Images are streamed to disk in chunks of this size
+DOWNLOAD_CHUNK_SIZE = 256 * 1024
+
+# Hourly request quota of the API key, DEMO_KEY gets far less than a personal key.
+# The X-RateLimit headers on each response take over once the first request is made.
+RATE_LIMIT = int(os.getenv("APOD_RATE_LIMIT", "30" if api_key in (None, "DEMO_KEY") else "1000"))
+# Longest a request waits for quota before failing with QuotaExceededError
+RATE_LIMIT_MAX_WAIT = float(os.getenv("APOD_RATE_LIMIT_MAX_WAIT", "10"))
+# Requests left in the quota that bulk work (range fetches) leaves for interactive lookups
+RATE_LIMIT_RESERVE = 5
+# After a host can't be reached, requests to it fail straight away for this many seconds
+OFFLINE_RETRY = float(os.getenv("APOD_OFFLINE_RETRY", "60"))
+
+
+
+class ApodError(Exception):
+    def __init__(self, message, status_code=None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+
+class NotAnImageError(ApodError):
+    pass
+
+
+
+class QuotaExceededError(ApodError):
+    pass
+
+
+
+class OfflineError(ApodError):
+    pass
+
+
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+
+#Return the shared keep-alive session for the host of the url
+def get_session(url):
+    host = urlparse(url).netloc
+    with _sessions_lock:
+        session = _sessions.get(host)
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=POOL_SIZE)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _sessions[host] = session
+        return session
+
+
+
+#Client-side token bucket for the API key's hourly quota
+# The bucket refills at limit/hour and is corrected from the X-RateLimit-Limit and
+# X-RateLimit-Remaining headers of every API response.  When it is empty acquire() queues the
+# caller until a token is due, or raises QuotaExceededError if that is further off than max_wait.
+class RateLimiter:
+    def __init__(self, limit_per_hour):
+        self.condition = threading.Condition()
+        self.limit = limit_per_hour
+        self.tokens = float(limit_per_hour)
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.limit, self.tokens + (now - self.updated) * self.limit / 3600)
+        self.updated = now
+
+    #Take a token, reserve tokens are left for callers without a reserve
+    def acquire(self, reserve=0, max_wait=None):
+        if max_wait is None:
+            max_wait = RATE_LIMIT_MAX_WAIT
+        deadline = time.monotonic() + max_wait
+        with self.condition:
+            while True:
+                self._refill()
+                if self.tokens >= reserve + 1:
+                    self.tokens -= 1
+                    return
+                wait = (reserve + 1 - self.tokens) * 3600 / self.limit
+                if time.monotonic() + wait > deadline:
+                    raise QuotaExceededError(f"The NASA API quota is used up, more requests are allowed in "
+                                             f"{max(1, round(wait / 60))} minutes.", 429)
+                self.condition.wait(wait)
+
+    def update(self, headers):
+        limit = headers.get("X-RateLimit-Limit")
+        remaining = headers.get("X-RateLimit-Remaining")
+        with self.condition:
+            self._refill()
+            if limit and limit.isdigit() and int(limit) > 0:
+                self.limit = int(limit)
+            if remaining and remaining.isdigit():
+                self.tokens = min(self.limit, int(remaining))
+            self.condition.notify_all()
+
+    #The server said the quota is gone
+    def exhausted(self):
+        with self.condition:
+            self._refill()
+            self.tokens = 0
+            self.updated = time.monotonic()
+
+
+
+rate_limiter = RateLimiter(RATE_LIMIT)
+
+
+
+_offline_until = {}
+_offline_lock = threading.Lock()
+
+
+
+#True while requests to the host of url (or to any host) are failing fast after a connection failure
+def is_offline(url=None):
+    now = time.monotonic()
+    with _offline_lock:
+        if url is None:
+            return any(until > now for until in _offline_until.values())
+        return _offline_until.get(urlparse(url).netloc, 0) > now
+
+
+
+def _set_offline(host, offline):
+    with _offline_lock:
+        if offline:
+            _offline_until[host] = time.monotonic() + OFFLINE_RETRY
+        else:
+            _offline_until.pop(host, None)
+
+
+
+#GET a url through the pooled session for its host
+# Transient failures (429 and 5xx) are retried with jittered exponential backoff, honouring
+# Retry-After.  Raises ApodError when the request can't succeed.  A host that can't be
+# connected to, times out, or keeps failing with 5xx, is marked offline: this raises
+# OfflineError at once and so does every request to the host for the next OFFLINE_RETRY
+# seconds, so callers can fall back to the cache without waiting on the network.
+# Requests to the API go through rate_limiter, reserve is passed on to its acquire().
+def http_get(url, stream=False, headers=None, reserve=0, read_timeout=READ_TIMEOUT):
+    host = urlparse(url).netloc
+    limited = url.startswith(API_BASE)
+    if is_offline(url):
+        raise OfflineError(f"{host} is unreachable, trying again within {OFFLINE_RETRY:.0f} seconds.")
+
+    for attempt in range(MAX_RETRIES + 1):
+        if limited:
+            rate_limiter.acquire(reserve)
+        try:
+            response = get_session(url).get(url, stream=stream, headers=headers,
+                                            timeout=(CONNECT_TIMEOUT, read_timeout))
+        except (requests.ConnectionError, requests.Timeout) as e:
+            # A pooled keep-alive connection the server dropped gets one more try straight away,
+            # a server that stalls has already cost a whole timeout
+            if attempt or isinstance(e, requests.Timeout):
+                _set_offline(host, True)
+                raise OfflineError(f"Could not reach {host}: {e}")
+            error = OfflineError(f"Could not reach {host}: {e}")
+            delay = 0
+        except requests.RequestException as e:
+            error = ApodError(f"Could not reach {host}: {e}")
+            delay = _backoff(attempt)
+        else:
+            _set_offline(host, False)
+            if limited:
+                rate_limiter.update(response.headers)
+                if response.status_code == 429:
+                    rate_limiter.exhausted()
+            if response.status_code < 400:
+                return response
+
+            error = ApodError(f"{host} returned HTTP {response.status_code}: {_error_message(response)}",
+                              response.status_code)
+            if response.status_code not in RETRY_STATUS:
+                raise error
+
+            delay = _retry_after(response)
+            response.close()
+            if delay is None:
+                delay = _backoff(attempt)
+            elif delay > RETRY_AFTER_MAX:
+                raise error
+
+        if attempt == MAX_RETRIES:
+            if error.status_code is None or error.status_code >= 500:
+                _set_offline(host, True)
+            if error.status_code is None:
+                raise OfflineError(str(error))
+            raise error
+        time.sleep(delay)
+
+
+
+#True for errors that mean NASA can't be reached right now, as opposed to a bad date or a video
+# Only failed connections, the quota and server errors count, anything else won't go away on a retry.
+def is_unavailable(error):
+    if isinstance(error, (OfflineError, QuotaExceededError)):
+        return True
+    return error.status_code is not None and error.status_code >= 500
+
+
+
+#Full jitter backoff: a random delay up to the exponential cap for this attempt
+def _backoff(attempt):
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+
+
+
+#Seconds to wait from a Retry-After header, which is either a number of seconds or an HTTP date
+def _retry_after(response):
+    value = response.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=timezone.utc)
+    return max(0.0, (when - datetime.now(timezone.utc)).total_seconds())
+
+
+
+#The NASA API reports errors as JSON with a msg field, fall back to the status reason
+def _error_message(response):
+    try:
+        data = response.json()
+    except ValueError:
+        return response.reason
+    if isinstance(data, dict):
+        error = data.get('error')
+        if isinstance(error, dict):
+            return error.get('message') or response.reason
+        return data.get('msg') or response.reason
+    return response.reason
+
+
+
+#Decode a JSON API response, raising ApodError if the body isn't JSON
+def _json(response):
+    try:
+        return response.json()
+    except ValueError:
+        raise ApodError("NASA API returned an invalid response.")
+
+
+
+# First day of the APOD archive
+APOD_START_DATE = datetime(1995, 6, 16)
+
+# Number of days fetched per start_date/end_date request when loading a range
+RANGE_CHUNK_DAYS = 90
+
+
+
+#Raise ApodError for a date outside the archive, before it reaches the record store or the API
+def check_date(date):
+    try:
+        day = datetime.strptime(date, '%Y-%m-%d')
+    except (TypeError, ValueError):
+        raise ApodError(f"'{date}' is not a date, expected YYYY-MM-DD.", 400)
+    if not APOD_START_DATE <= day <= datetime.today():
+        raise ApodError(f"There is no APOD for {date}, the archive runs from "
+                        f"{APOD_START_DATE:%Y-%m-%d} to today.", 400)
+
+
+
+def get_apod_metadata(date):
+    check_date(date)
+    # Past APOD entries never change, so use the cached metadata if we have it
+    data = _cached_metadata(date)
+    if data is not None:
+        instrument.count("metadata_cache_hit")
+        return data
+    instrument.count("metadata_cache_miss")
+    return _coalesced(("metadata", date), lambda: _fetch_metadata(date))
+
+
+
+def _fetch_metadata(date):
+    # Another caller may have stored it while we waited to become the fetcher
+    data = _cached_metadata(date)
+    if data is not None:
+        return data
+
     #create the API URL with the specified date
     API_URL_DATE = f"{API_URL}&date={date}"
 
     # Make a request to the NASA API for the specified date
-    response = requests.get(API_URL_DATE)
+    with instrument.stage("api", date=date) as timer:
+        response = http_get(API_URL_DATE, read_timeout=LOOKUP_READ_TIMEOUT)
+        data = _json(response)
+        timer.set(bytes=len(response.content))
+    _index_records([data])
+    return data
+
+
+
+#Metadata from the record store, or from the JSON cache of versions before the store
+def _cached_metadata(date):
+    store = record_store.get_store()
+    data = store.metadata(date)
+    if data is None:
+        data = apod_cache.load_metadata(date)
+        if data is not None:
+            store.add_records([data])
+    return data
+
+
 
-    # Check if the request was successful
-    if response.status_code != 200:
-        print("Error fetching data from NASA API.")
-        return None, None, None
-        
-    data = response.json()
+_inflight = {}
+_inflight_lock = threading.Lock()
+
+
+
+#Run fetch once for everyone asking for the same key at the same time
+# The first caller does the work, the others wait for its result (or its exception).
+def _coalesced(key, fetch):
+    with _inflight_lock:
+        future = _inflight.get(key)
+        leader = future is None
+        if leader:
+            future = _inflight[key] = Future()
+
+    if not leader:
+        instrument.count("coalesced")
+        return future.result()
+
+    try:
+        result = fetch()
+    except BaseException as e:
+        future.set_exception(e)
+        raise
+    else:
+        future.set_result(result)
+        return result
+    finally:
+        with _inflight_lock:
+            del _inflight[key]
+
+
+
+#Get the metadata for every APOD between start_date and end_date (inclusive)
+# Dates are fetched in batched start_date/end_date requests of chunk_days each and
+# records are yielded in date order as each batch arrives.  Cached dates are not requested again.
+# Today's APOD may not be published yet and the API rejects a range that includes it, so the
+# batches stop at yesterday and today is looked up on its own, left out if it isn't out yet.
+def get_apod_range(start_date, end_date, chunk_days=RANGE_CHUNK_DAYS):
+    today = _to_datetime(datetime.today())
+    start = max(_to_datetime(start_date), APOD_START_DATE)
+    end = min(_to_datetime(end_date), today - timedelta(days=1))
+    with_today = start <= today <= _to_datetime(end_date)
+
+    chunk_start = start
+    while chunk_start <= end:
+        chunk_end = min(chunk_start + timedelta(days=chunk_days - 1), end)
+        dates = _date_strings(chunk_start, chunk_end)
+
+        records = {date: _cached_metadata(date) for date in dates}
+        missing = [date for date in dates if records[date] is None]
+
+        # Only ask the API for the span of dates we don't already have
+        if missing:
+            with instrument.stage("api_range", start=missing[0], end=missing[-1]) as timer:
+                response = http_get(f"{API_URL}&start_date={missing[0]}&end_date={missing[-1]}",
+                                    reserve=RATE_LIMIT_RESERVE)
+                fetched = _json(response)
+                timer.set(bytes=len(response.content), records=len(fetched))
+            for data in fetched:
+                records[data['date']] = data
+            _index_records(fetched)
+
+        for date in dates:
+            if records.get(date) is not None:
+                yield records[date]
+
+        chunk_start = chunk_end + timedelta(days=1)
+
+    if with_today:
+        try:
+            data = get_apod_metadata(today.strftime('%Y-%m-%d'))
+        except ApodError as e:
+            if is_unavailable(e):
+                raise
+            return
+        yield data
+
+
+
+#Stream a url to path in chunks so the whole file is never held in memory
+# The data goes to path + ".part" and is renamed into place once complete.  A leftover
+# .part file from an interrupted transfer is resumed with a Range request, and a transfer
+# that drops mid-stream is resumed the same way.  progress(done, total) is called after
+# every chunk, total is None when the server doesn't send a length.
+def download_file(url, path, progress=None):
+    part_path = path + ".part"
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    for attempt in range(MAX_RETRIES + 1):
+        offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+        headers = {"Range": f"bytes={offset}-"} if offset else None
+
+        try:
+            response = http_get(url, stream=True, headers=headers)
+        except ApodError as e:
+            # The partial file is stale or already complete, start over
+            if offset and e.status_code == 416:
+                os.remove(part_path)
+                continue
+            raise
+
+        with response:
+            # A server that ignores the Range header sends the whole file again
+            if response.status_code != 206:
+                offset = 0
+            total = _content_total(response, offset)
+
+            done = offset
+            try:
+                with open(part_path, 'ab' if offset else 'wb') as f:
+                    for chunk in response.iter_content(DOWNLOAD_CHUNK_SIZE):
+                        f.write(chunk)
+                        done += len(chunk)
+                        if progress is not None:
+                            progress(done, total)
+            except requests.RequestException as e:
+                if attempt == MAX_RETRIES:
+                    raise ApodError(f"Download of {url} was interrupted: {e}")
+                time.sleep(_backoff(attempt))
+                continue
+
+        if total is not None and done < total:
+            if attempt == MAX_RETRIES:
+                raise ApodError(f"Download of {url} ended after {done} of {total} bytes.")
+            continue
+
+        os.replace(part_path, path)
+        return path
+
+    raise ApodError(f"Could not download {url}.")
+
+
+
+#Total size of the file being downloaded, from Content-Range for partial responses
+def _content_total(response, offset):
+    content_range = response.headers.get("Content-Range", "")
+    if response.status_code == 206 and "/" in content_range:
+        total = content_range.rsplit("/", 1)[1]
+        if total.isdigit():
+            return int(total)
+    length = response.headers.get("Content-Length")
+    if length and length.isdigit():
+        return offset + int(length)
+    return None
+
+
+
+#Url of the image for an APOD metadata record
+# hd picks the high-definition hdurl when there is one, otherwise the standard resolution url
+def image_url(data, hd=True):
+    if hd and 'hdurl' in data:
+        return data['hdurl']
+    return data['url']
+
+
+
+#True if the record has a separate high-definition image
+def has_hd_image(data):
+    return 'hdurl' in data and data['hdurl'] != data['url']
+
+
+
+#Path of the cached image for an APOD metadata record, or None if it hasn't been downloaded
+def find_image_file(data, hd=True):
+    return apod_cache.find_image(data['date'], image_url(data, hd), hd or not has_hd_image(data))
+
+
+
+#Get the local path of the image for an APOD metadata record, downloading it into the cache if needed
+def get_image_file(data, progress=None, hd=True):
+    path = find_image_file(data, hd)
+    if path is not None:
+        instrument.count("image_cache_hit")
+        return path
+    instrument.count("image_cache_miss")
+    stored_hd = hd or not has_hd_image(data)
+    # The cache state in the record store is a hint, eviction doesn't clear it
+    record_store.get_store().set_cached(data['date'], stored_hd, False)
+
+    # Two downloads into the same .part file would corrupt it, so concurrent callers share one
+    url = image_url(data, hd)
+    path = apod_cache.image_path(data['date'], url, stored_hd)
+    return _coalesced(("image", path), lambda: _download_image(data, url, path, progress, hd))
+
+
+
+def _download_image(data, url, path, progress, hd):
+    if os.path.isfile(path):
+        return path
+
+    with instrument.stage("download", date=data['date'], hd=hd) as timer:
+        download_file(url, path, progress)
+        size = os.path.getsize(path)
+        timer.set(bytes=size)
+    instrument.count("bytes_downloaded", size)
+    apod_cache.evict(keep=(path,))
+
+    store = record_store.get_store()
+    stored_hd = hd or not has_hd_image(data)
+    store.set_cached(data['date'], stored_hd)
+    if stored_hd:
+        store.set_file_info(data['date'], size, record_store.file_hash(path))
+
+    # Record the size of HD images for the random mode filters
+    size = image_index.image_file_size(path) if hd else None
+    if size is not None:
+        index = image_index.get_index()
+        index.set_size(data['date'], *size)
+        index.save()
+    return path
+
+
+
+#Get the metadata for a date, making sure it's an image and not a video
+# Raises NotAnImageError if the APOD for that date is a video, ApodError if it can't be fetched
+def get_image_metadata(date):
+    data = get_apod_metadata(date)
 
     #Make sure it's an image, not a video
     if data['media_type'] != 'image':
-        print(f"The APOD for {date} is not an image.")
-        return None, None, None
-        
-    #use hdurl if available, otherwise use url
-    # This is the high-definition version of the image, if available
-    image_url = data['hdurl'] if 'hdurl' in data else data['url']
-
-    # This will download the image data and convert it to binary
-    image_data = requests.get(image_url).content
-
-    title = data['title']
-    caption = data['explanation']
+        raise NotAnImageError(f"The APOD for {date} is not an image.")
+    return data
+
+
+
+#Get the local image path, title and explanation for a date
+# Raises NotAnImageError if the APOD for that date is a video, ApodError if it can't be fetched
+def get_apod_image_file(date, progress=None):
+    data = get_image_metadata(date)
+    return get_image_file(data, progress), data['title'], data['explanation']
+
+
+
+#Local path and metadata of a cached image for a date, None if neither its HD nor SD image is cached
+def get_cached_image(date):
+    data = _cached_metadata(date)
+    if data is None or data.get('media_type') != 'image':
+        return None
+    path = find_image_file(data) or find_image_file(data, hd=False)
+    if path is None:
+        return None
+    return path, data
+
+
+
+#Best locally available image when NASA can't be reached, None if nothing is cached
+# The date itself if its image is cached.  Otherwise current mode takes the cached image
+# closest to the date and random mode any cached image.  Returns (date, path, metadata).
+def find_cached_image(date=None, mode="current"):
+    date = date or datetime.today().strftime('%Y-%m-%d')
+    found = get_cached_image(date)
+    if found is not None:
+        return (date,) + found
+
+    store = record_store.get_store()
+    days = set(store.cached_days(True)) | set(store.cached_days(False))
+    if mode == "random":
+        days = list(days)
+        random.shuffle(days)
+    else:
+        target = record_store.day_of(date)
+        days = sorted(days, key=lambda day: (abs(day - target), -day))
+
+    for day in days:
+        candidate = record_store.date_of(day)
+        found = get_cached_image(candidate)
+        if found is not None:
+            return (candidate,) + found
+        # The image was evicted since the store last saw it
+        store.set_cached(candidate, True, False)
+        store.set_cached(candidate, False, False)
+    return None
+
+
+
+#Get the image bytes, title and explanation for a date
+# Raises NotAnImageError if the APOD for that date is a video, ApodError if it can't be fetched
+def get_apod_image(date):
+    image_path, title, caption = get_apod_image_file(date)
+    with open(image_path, 'rb') as f:
+        image_data = f.read()
     
     return image_data, title, caption
 
 
 
-def get_daily_image(mode="current"):
+def _to_datetime(date):
+    if isinstance(date, str):
+        return datetime.strptime(date, '%Y-%m-%d')
+    return datetime(date.year, date.month, date.day)
+
+
+
+def _date_strings(start, end):
+    return [(start + timedelta(days=i)).strftime('%Y-%m-%d') for i in range((end - start).days + 1)]
+
+
+
+#Bring the image index up to date with every APOD through yesterday
+# Only the dates after the last sync are requested, so after the first run this is one small request a day.
+# Today's entry is left out because it may not be published yet, it is indexed when it is fetched.
+# Returns the number of dates synced.
+def sync_image_index(chunk_days=365):
+    index = image_index.get_index()
+    index.load()
+    start = APOD_START_DATE
+    if index.synced_through:
+        start = _to_datetime(index.synced_through) + timedelta(days=1)
+    end = datetime.today() - timedelta(days=1)
+    if start > end:
+        return 0
+
+    # get_apod_range indexes what it fetches, this adds the dates that were already cached
+    records = list(get_apod_range(start, end, chunk_days))
+    index.add_records(records)
+    index.synced_through = end.strftime('%Y-%m-%d')
+    index.save()
+    return len(records)
+
+
+
+#Fill in the size of indexed images that haven't been downloaded, from the first bytes of each file
+# Only the image header is requested, which is enough for the minimum size and landscape filters.
+# Run from "python -m apod index --sizes".  Returns the number of sizes found, an image that
+# can't be fetched is skipped, losing the connection stops the probe.
+def probe_image_sizes(limit=None, progress=None):
+    index = image_index.get_index()
+    dates = index.unsized_dates()[:limit]
+    found = 0
+    for count, date in enumerate(dates, 1):
+        try:
+            data = get_apod_metadata(date)
+            response = http_get(image_url(data), stream=True,
+                                headers={"Range": f"bytes=0-{image_index.HEADER_BYTES - 1}"})
+            with response:
+                header = b''
+                for chunk in response.iter_content(DOWNLOAD_CHUNK_SIZE):
+                    header += chunk
+                    if len(header) >= image_index.HEADER_BYTES:
+                        break
+        except ApodError as e:
+            if is_unavailable(e):
+                index.save()
+                raise
+            continue
+        size = image_index.image_size(header)
+        if size is not None:
+            index.set_size(date, *size)
+            found += 1
+        if count % 100 == 0:
+            index.save()
+            if progress is not None:
+                progress(count, len(dates))
+    index.save()
+    return found
+
+
+
+#Save new records to the record store, which is the metadata cache, and the search index
+def _index_records(records):
+    index = image_index.get_index()
+    if index.add_records(records):
+        index.save()
+    try:
+        search_index.get_index().add_records(records)
+    except sqlite3.Error as e:
+        instrument.logger.warning(f"Could not update the search index: {e}")
+
+
+
+#Bring the search index up to date with every APOD through yesterday
+# Records already in the metadata cache are read from disk, so the first sync only asks the
+# API for dates that were never fetched.  Later syncs start after the last synced date.
+def sync_search_index(chunk_days=365):
+    index = search_index.get_index()
+    start = APOD_START_DATE
+    if index.synced_through:
+        start = _to_datetime(index.synced_through) + timedelta(days=1)
+    end = datetime.today() - timedelta(days=1)
+    if start > end:
+        return 0
+
+    # Records fetched from the API are indexed as they arrive, the batches add the cached ones
+    before = index.count()
+    batch = []
+    for data in get_apod_range(start, end, chunk_days):
+        batch.append(data)
+        if len(batch) >= chunk_days:
+            index.add_records(batch)
+            batch = []
+    index.add_records(batch)
+    index.synced_through = end.strftime('%Y-%m-%d')
+    return index.count() - before
+
+
+
+#Search the titles and explanations of the archive, best matches first
+# Returns dicts with date, title, media_type and a snippet of the explanation with the matches
+# in [brackets].  With sync=True the index is brought up to date first, which needs the network
+# the first time it runs.
+def search_apod(query, limit=20, images_only=False, sync=False):
+    if sync:
+        try:
+            sync_search_index()
+        except ApodError as e:
+            instrument.logger.warning(f"Could not update the search index: {e}")
+    with instrument.stage("search", query=query) as timer:
+        results = search_index.get_index().search(query, limit, images_only)
+        timer.set(results=len(results))
+    return results
+
+
+
+#Pick the date for the daily image
+# Random mode picks from the image index, so it never lands on a video day, and favours images
+# with a good wallpaper score (see scoring.py).  The optional size filters only match images
+# whose size is known (downloaded, or read by probe_image_sizes) and min_score only drops scored
+# images.  When nothing matches, the filters are dropped with a warning.
+def get_daily_image(mode="current", min_width=0, min_height=0, landscape=False, min_score=0):
     if mode == "random":
-        # Pick a random date between June 16, 1995 and today
-        start_date = datetime(1995, 6, 16)
+        index = image_index.get_index()
+        try:
+            sync_image_index()
+        except ApodError as e:
+            instrument.logger.warning(f"Could not update the image index: {e}")
+
+        date_str = index.random_date(min_width, min_height, landscape, min_score)
+        if date_str is None and (min_width or min_height or landscape or min_score):
+            instrument.logger.warning("No indexed image matches the filters, picking from every image. "
+                                      "Sizes of images that weren't downloaded are read by probe_image_sizes.")
+            date_str = index.random_date()
+        if date_str is not None:
+            instrument.logger.info(f"daily image random date = {date_str}")
+            return date_str
+
+        # No index yet, pick a random date between June 16, 1995 and today
+        start_date = APOD_START_DATE
         end_date = datetime.today()
-        print (f"daily image current date = {end_date}")
+        instrument.logger.info(f"daily image current date = {end_date}")
         random_date = start_date + timedelta(days=random.randint(0, (end_date - start_date).days))
         date_str = random_date.strftime('%Y-%m-%d')
-        print (f"daily image random date = {date_str}")
+        instrument.logger.info(f"daily image random date = {date_str}")
         return date_str
     else:
         # Use today's date
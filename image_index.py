@@ -0,0 +1,175 @@
+import os
+import json
+import random
+import itertools
+import struct
+import threading
+
+import apod_cache
+import record_store
+
+
+
+# Pick weight of images that haven't been scored, about the score of an average image
+UNSCORED_WEIGHT = 128
+# How much of a file to read when looking for the image size in its header
+HEADER_BYTES = 256 * 1024
+
+
+
+#JSON file the index was kept in before the record store, imported once and removed
+def index_path():
+    return os.path.join(apod_cache.cache_dir(), "image_index.json")
+
+
+
+#Index of which APOD dates are images, with their size once it is known
+# Filled from bulk metadata and from the images as they are downloaded, and kept in the
+# memory-mapped record store so loading it reads nothing up front.  Random picks are made from
+# a list of image days, so one pick is O(1) and never lands on a video day.  The list for each
+# combination of filters is built in one pass over the store and reused until the store changes.
+class ImageIndex:
+    def __init__(self, store=None):
+        self.store = store or record_store.get_store()
+        self.lock = threading.RLock()
+        self.loaded = False
+        self._candidates = {}
+        self._version = None
+
+    def load(self):
+        with self.lock:
+            if self.loaded:
+                return
+            self.loaded = True
+            self._import_json(index_path())
+
+    def _import_json(self, path):
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        for date, size in data.get('sizes', {}).items():
+            if size:
+                self.store.set_size(date, *size)
+            else:
+                self.store.set_media_type(date, 'image')
+        for date in data.get('non_images', []):
+            self.store.set_media_type(date, 'other')
+        if data.get('synced_through') and self.store.synced_through is None:
+            self.store.synced_through = data['synced_through']
+        self.store.flush()
+        os.remove(path)
+
+    def save(self):
+        self.store.flush()
+
+    #Every date up to this one has been checked against the API
+    @property
+    def synced_through(self):
+        self.load()
+        return self.store.synced_through
+
+    @synced_through.setter
+    def synced_through(self, date):
+        self.store.synced_through = date
+
+    #Add APOD metadata records, returns the number of dates that were new to the index
+    def add_records(self, records):
+        self.load()
+        return self.store.add_records(records)
+
+    def set_size(self, date, width, height):
+        self.load()
+        self.store.set_size(date, width, height)
+
+    #Dates whose size hasn't been recorded yet
+    def unsized_dates(self):
+        self.load()
+        return [record_store.date_of(day) for day in self.store.image_days(unsized=True)]
+
+    #Candidate days and their cumulative pick weights, built once per filter until the store changes
+    # A scored image is weighted by its score (see scoring.py), an unscored one by UNSCORED_WEIGHT.
+    def _weighted(self, min_width, min_height, landscape, min_score):
+        self.load()
+        key = (min_width, min_height, landscape, min_score)
+        with self.lock:
+            if self._version != self.store.version:
+                self._candidates.clear()
+                self._version = self.store.version
+            entry = self._candidates.get(key)
+            if entry is None:
+                days = self.store.image_days(min_width, min_height, landscape, min_score=min_score)
+                weights = [score or UNSCORED_WEIGHT for score in self.store.scores(days)]
+                entry = (days, list(itertools.accumulate(weights)))
+                self._candidates[key] = entry
+            return entry
+
+    #A random image date matching the filters, None if nothing matches
+    # Better wallpapers are picked more often, a pick is a binary search over the cumulative weights.
+    def random_date(self, min_width=0, min_height=0, landscape=False, min_score=0):
+        days, cum_weights = self._weighted(min_width, min_height, landscape, min_score)
+        if not days:
+            return None
+        return record_store.date_of(random.choices(days, cum_weights=cum_weights)[0])
+
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+
+#The shared index over the record store in the cache folder
+def get_index():
+    global _index
+    with _index_lock:
+        if _index is None or _index.store.folder != record_store.store_folder():
+            _index = ImageIndex()
+        return _index
+
+
+
+#Width and height of a JPEG, PNG or GIF from the start of the file, None if it can't be found
+def image_size(header):
+    if header[:8] == b'\x89PNG\r\n\x1a\n' and len(header) >= 24:
+        return struct.unpack('>II', header[16:24])
+    if header[:6] in (b'GIF87a', b'GIF89a') and len(header) >= 10:
+        return struct.unpack('<HH', header[6:10])
+    if header[:2] == b'\xff\xd8':
+        return _jpeg_size(header)
+    return None
+
+
+
+#Walk the JPEG markers up to the start of frame, which holds the size
+def _jpeg_size(header):
+    pos = 2
+    while pos + 4 <= len(header):
+        if header[pos] != 0xFF:
+            return None
+        marker = header[pos + 1]
+        # Fill bytes and markers without a length
+        if marker == 0xFF:
+            pos += 1
+            continue
+        if marker in (0x01, 0xD8) or 0xD0 <= marker <= 0xD7:
+            pos += 2
+            continue
+        length = struct.unpack('>H', header[pos + 2:pos + 4])[0]
+        if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+            if pos + 9 > len(header):
+                return None
+            height, width = struct.unpack('>HH', header[pos + 5:pos + 9])
+            return width, height
+        pos += 2 + length
+    return None
+
+
+
+def image_file_size(path):
+    try:
+        with open(path, 'rb') as f:
+            return image_size(f.read(HEADER_BYTES))
+    except OSError:
+        return None
@@ -0,0 +1,102 @@
+import os
+import shutil
+import tempfile
+import threading
+
+import apod_cache
+import instrument
+import record_store
+
+
+
+# Size budget of the stored objects, the current wallpaper is kept outside it
+STORE_MAX_MB = 200
+CURRENT_PREFIX = "current_"
+
+_current_lock = threading.Lock()
+
+
+
+def store_dir():
+    return os.path.join(apod_cache.cache_dir(), "store")
+
+
+
+def objects_dir():
+    return os.path.join(store_dir(), "objects")
+
+
+
+#Content hash of an image, taken from the record store when the download already hashed it
+def content_hash(path, date=None):
+    if date is not None:
+        info = record_store.get_store().file_info(date)
+        if info is not None and info[0] == os.path.getsize(path):
+            instrument.count("store_hash_reused")
+            return info[1]
+    return record_store.file_hash(path)
+
+
+
+#Content-addressed store of images, every object is named by the hash of its content
+# Identical images are stored once.  Files are put in place with a temp name and a rename, as a
+# hard link to the source when the drive supports it so no image data is copied at all.  The
+# stored file stays put when the cache evicts or replaces the image it came from, so it is what
+# the window renders the wallpaper from.  Reads and hashes files, so keep it off the GUI thread.
+def put(path, date=None):
+    ext = os.path.splitext(path)[1].lower() or ".jpg"
+    object_path = os.path.join(objects_dir(), f"{content_hash(path, date):016x}{ext}")
+    if os.path.isfile(object_path):
+        instrument.count("store_dedup")
+        apod_cache.touch(object_path)
+        return object_path
+
+    _link_or_copy(path, object_path)
+    apod_cache.evict(STORE_MAX_MB * 1024 * 1024, keep=(object_path,), folder=os.path.join("store", "objects"))
+    return object_path
+
+
+
+#Make path the current wallpaper file and return the path to hand to the desktop
+# The caches evict by LRU, so a wallpaper set straight from them can disappear under the desktop.
+# The current wallpaper is linked (or copied) into the store folder instead, outside every
+# budget, and named by its content hash: setting the same image again writes nothing, and a new
+# image gets a new path, which desktops that skip a path they already show need.  Only the
+# newest current file is kept.
+def set_current(path, date=None):
+    ext = os.path.splitext(path)[1].lower() or ".jpg"
+    name = f"{CURRENT_PREFIX}{content_hash(path, date):016x}{ext}"
+    current = os.path.join(store_dir(), name)
+    with _current_lock:
+        if os.path.isfile(current):
+            instrument.count("store_current_unchanged")
+        else:
+            _link_or_copy(path, current)
+        for other in os.listdir(store_dir()):
+            if other.startswith(CURRENT_PREFIX) and other != name:
+                try:
+                    os.remove(os.path.join(store_dir(), other))
+                except OSError:
+                    pass
+    return current
+
+
+
+#Put source at path with a rename, hard linked when possible, otherwise copied
+def _link_or_copy(source, path):
+    folder = os.path.dirname(path)
+    os.makedirs(folder, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=folder, suffix=".tmp")
+    os.close(fd)
+    try:
+        os.remove(tmp_path)
+        try:
+            os.link(source, tmp_path)
+        except OSError:
+            shutil.copyfile(source, tmp_path)
+            instrument.count("store_bytes_copied", os.path.getsize(tmp_path))
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
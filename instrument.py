@@ -0,0 +1,143 @@
+import os
+import json
+import time
+import logging
+import threading
+from collections import deque
+
+
+
+# Timing of the fetch -> decode -> save -> set pipeline, turned on with APOD_STATS=1 or enable()
+# When it is off stage() hands back a shared no-op object, so an instrumented block costs one
+# function call and a flag check.
+
+logger = logging.getLogger("apod")
+
+ENABLED = os.getenv("APOD_STATS", "") not in ("", "0")
+# Samples kept per stage for the rolling percentiles
+WINDOW = 500
+
+_lock = threading.Lock()
+_samples = {}
+_counters = {}
+
+
+
+#Times one run of a stage and logs it as a JSON line, extra fields can be added with set()
+class _Timer:
+    __slots__ = ("name", "fields", "start")
+
+    def __init__(self, name, fields):
+        self.name = name
+        self.fields = fields
+
+    def set(self, **fields):
+        self.fields.update(fields)
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        elapsed = time.perf_counter() - self.start
+        with _lock:
+            samples = _samples.get(self.name)
+            if samples is None:
+                samples = _samples[self.name] = deque(maxlen=WINDOW)
+            samples.append(elapsed)
+        record = {"stage": self.name, "ms": round(elapsed * 1000, 2), **self.fields}
+        if exc_type is not None:
+            record["error"] = exc_type.__name__
+        logger.info(json.dumps(record))
+        return False
+
+
+
+class _NullTimer:
+    __slots__ = ()
+
+    def set(self, **fields):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+
+_NULL_TIMER = _NullTimer()
+
+
+
+#Context manager timing a pipeline stage, e.g. with instrument.stage("download", date=date) as s:
+def stage(name, **fields):
+    if not ENABLED:
+        return _NULL_TIMER
+    return _Timer(name, fields)
+
+
+
+#Add to a counter such as bytes downloaded or cache hits
+def count(name, amount=1):
+    if not ENABLED:
+        return
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + amount
+
+
+
+def enable(on=True):
+    global ENABLED
+    ENABLED = on
+
+
+
+def reset():
+    with _lock:
+        _samples.clear()
+        _counters.clear()
+
+
+
+def _percentile(ordered, fraction):
+    return ordered[min(len(ordered) - 1, round(fraction * (len(ordered) - 1)))]
+
+
+
+#Rolling percentiles in milliseconds for every stage, and the counters
+def stats():
+    with _lock:
+        samples = {name: sorted(values) for name, values in _samples.items()}
+        counters = dict(_counters)
+
+    stages = {}
+    for name, ordered in samples.items():
+        stages[name] = {
+            "count": len(ordered),
+            "p50_ms": _percentile(ordered, 0.5) * 1000,
+            "p90_ms": _percentile(ordered, 0.9) * 1000,
+            "p99_ms": _percentile(ordered, 0.99) * 1000,
+            "max_ms": ordered[-1] * 1000,
+        }
+    return {"stages": stages, "counters": counters}
+
+
+
+def format_stats():
+    data = stats()
+    if not data["stages"] and not data["counters"]:
+        if not ENABLED:
+            return "Timing is off, start the app with APOD_STATS=1 or turn on Record Timings."
+        return "Nothing has been recorded yet."
+
+    lines = [f"{'stage':<16}{'n':>6}{'p50 ms':>10}{'p90 ms':>10}{'p99 ms':>10}{'max ms':>10}"]
+    for name, values in sorted(data["stages"].items()):
+        lines.append(f"{name:<16}{values['count']:>6}{values['p50_ms']:>10.1f}{values['p90_ms']:>10.1f}"
+                     f"{values['p99_ms']:>10.1f}{values['max_ms']:>10.1f}")
+    if data["counters"]:
+        lines.append("")
+        for name, value in sorted(data["counters"].items()):
+            lines.append(f"{name:<32}{value:>12}")
+    return "\n".join(lines)
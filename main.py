@@ -1,15 +1,24 @@
 import os
 import sys
-import ctypes
+import logging
+from datetime import datetime
 
-from PyQt5.QtWidgets import (QApplication, QMainWindow, QWidget, QAction,
+from PyQt5.QtWidgets import (QApplication, QMainWindow, QWidget, QAction, QActionGroup,
                              QHBoxLayout, QVBoxLayout, QGridLayout, QLabel, QMessageBox,
                              QLineEdit, QTextEdit, QPushButton, QRadioButton, QScrollArea, QDialog,
-                             QComboBox, QGroupBox, QSystemTrayIcon, QMenu)
+                             QComboBox, QGroupBox, QSystemTrayIcon, QMenu, QProgressBar, QTimeEdit)
 from PyQt5.QtGui import QIcon, QFont, QPixmap
-from PyQt5.QtCore import Qt, QTimer, QTime
+from PyQt5.QtCore import Qt, QTimer, QTime, QThreadPool
 
 import get_apod
+import instrument
+import renditions
+import rotation
+import scheduler
+import wallpaper
+from gallery import GalleryDialog
+from search_dialog import SearchDialog
+from workers import ImageLoader, WallpaperTask, PrefetchTask, RevalidateTask
 
 class MainWindow(QMainWindow):
     def __init__(self):
@@ -22,11 +31,67 @@ class MainWindow(QMainWindow):
 
         #create the menu bar
         menu = self.menuBar()
+        view_menu = menu.addMenu("&View")
+        self.gallery_action = QAction("&Gallery...", self)
+        self.gallery_action.triggered.connect(self.show_gallery)
+        view_menu.addAction(self.gallery_action)
+        self.search_action = QAction("&Search...", self)
+        self.search_action.setShortcut("Ctrl+F")
+        self.search_action.triggered.connect(self.show_search)
+        view_menu.addAction(self.search_action)
+        view_menu.addSeparator()
+        #Show the standard resolution image first while the HD image downloads
+        self.progressive_action = QAction("&Progressive Preview", self)
+        self.progressive_action.setCheckable(True)
+        self.progressive_action.setChecked(True)
+        view_menu.addAction(self.progressive_action)
+        #How the image is fitted to each screen when it is set as the wallpaper
+        fit_menu = view_menu.addMenu("Wallpaper &Fit")
+        self.fit_group = QActionGroup(self)
+        for fit_mode, label in ((renditions.FIT_FILL, "&Fill Screen (crop)"), (renditions.FIT_FIT, "Fit &Inside Screen")):
+            action = QAction(label, self)
+            action.setCheckable(True)
+            action.setData(fit_mode)
+            action.setChecked(fit_mode == renditions.FIT_FILL)
+            self.fit_group.addAction(action)
+            fit_menu.addAction(action)
+        #Cycle the wallpaper through a playlist every few minutes, see rotation.py
+        rotation_menu = view_menu.addMenu("Wallpaper &Rotation")
+        self.rotation_group = QActionGroup(self)
+        for source, label in (("off", "&Off"), ("random", "&Random Picks"), ("gallery", "&Gallery Range"),
+                              ("search", "&Search Results")):
+            action = QAction(label, self)
+            action.setCheckable(True)
+            action.setData(source)
+            action.setChecked(source == "off")
+            self.rotation_group.addAction(action)
+            rotation_menu.addAction(action)
+        self.rotation_group.triggered.connect(self.rotation_source_changed)
+        rotation_menu.addSeparator()
+        self.rotation_interval_group = QActionGroup(self)
+        for minutes in (5, 15, 30, 60):
+            action = QAction(f"Every {minutes} Minutes", self)
+            action.setCheckable(True)
+            action.setData(minutes)
+            action.setChecked(minutes == rotation.DEFAULT_INTERVAL_MINUTES)
+            self.rotation_interval_group.addAction(action)
+            rotation_menu.addAction(action)
+        self.rotation_interval_group.triggered.connect(lambda action: self.rotation.set_interval(action.data()))
         help_menu = menu.addMenu("&Help")
         self.instruction_action = QAction("&Instructions", self)
         help_menu.addAction(self.instruction_action)
         self.about_action = QAction("&About", self)
         help_menu.addAction(self.about_action)
+        help_menu.addSeparator()
+        #Per-stage timings of the fetch/decode/save/set pipeline, see instrument.py
+        self.record_timings_action = QAction("&Record Timings", self)
+        self.record_timings_action.setCheckable(True)
+        self.record_timings_action.setChecked(instrument.ENABLED)
+        self.record_timings_action.toggled.connect(instrument.enable)
+        help_menu.addAction(self.record_timings_action)
+        self.stats_action = QAction("Pipeline &Stats", self)
+        self.stats_action.triggered.connect(self.show_stats)
+        help_menu.addAction(self.stats_action)
         self.instruction_action.triggered.connect(self.show_instructions)
         self.about_action.triggered.connect(self.show_about)
 
@@ -93,8 +158,14 @@ class MainWindow(QMainWindow):
         self.current_radio.setChecked(True)
         self.random_radio = QRadioButton("Random", self)
 
+        #Time of the daily update
+        self.daily_time_edit = QTimeEdit(self)
+        self.daily_time_edit.setDisplayFormat("HH:mm")
+        self.daily_time_edit.setFixedSize(80,30)
+
         self.radio_group_layout.addWidget(self.current_radio)
         self.radio_group_layout.addWidget(self.random_radio)
+        self.radio_group_layout.addWidget(self.daily_time_edit)
 
 
         #Create the image and explanation display area
@@ -139,6 +210,38 @@ class MainWindow(QMainWindow):
         self.tray_icon.activated.connect(self.on_tray_icon_activated)
 
 
+        #Images are fetched, decoded and scaled on the thread pool
+        # request_id goes up with every request so results from superseded requests can be dropped
+        self.thread_pool = QThreadPool(self)
+        self.request_id = 0
+        self.current_loader = None
+        # True while a preview is shown and its HD image is still downloading
+        self.hd_pending = False
+        self.image_date = None
+        self.wallpaper_backend = wallpaper.get_backend()
+        self.gallery_dialog = None
+
+        #While NASA can't be reached a cached image stands in for the one asked for
+        # (date, set_wallpaper, daily) of that request, it is fetched again once NASA is back
+        self.revalidate = None
+        self.revalidate_running = False
+        self.revalidate_timer = QTimer(self)
+        self.revalidate_timer.setInterval(int(get_apod.OFFLINE_RETRY * 1000))
+        self.revalidate_timer.timeout.connect(self.revalidate_cached)
+
+        self.rotation = rotation.Rotation(self.wallpaper_backend, self.thread_pool, self)
+        self.rotation.switched.connect(self.on_rotation_switched)
+        self.rotation.failed.connect(self.on_rotation_failed)
+        self.search_dialog = None
+
+        #Download progress is shown in the status bar while an image is loading
+        self.progress_bar = QProgressBar()
+        self.progress_bar.setFixedWidth(200)
+        self.progress_bar.setTextVisible(False)
+        self.progress_bar.hide()
+        self.statusBar().addPermanentWidget(self.progress_bar)
+
+
         self.initUI()
 
 
@@ -210,25 +313,7 @@ class MainWindow(QMainWindow):
                 month = f"0{month}"
             date = f"{year}-{month}-{day}"
 
-            image_data, title, caption = get_apod.get_apod_image(date)
-            if image_data is None:
-                QMessageBox.warning(self, "Error", "No image found for the selected date.")
-                return
-            
-            self.save_file(image_data)
-
-            #display the image
-            pixmap = QPixmap()
-            pixmap.loadFromData(image_data)
-
-            # Resize to fit width (optional)
-            scaled_pixmap = pixmap.scaledToWidth(780, Qt.SmoothTransformation)
-            self.image_label.setPixmap(scaled_pixmap)
-
-            # Set explanation text
-            self.text_area.setText(f"{title}\n\n{caption}")
-
-            self.save_button.setFocus()
+            self.load_image(date)
         else:
             QMessageBox.warning(self, "Error", "Please select a valid date.")
 
@@ -238,35 +323,40 @@ class MainWindow(QMainWindow):
     def get_current_button_clicked(self):
         # Get the current date
         date = get_apod.get_daily_image(mode="current")
-        image_data, title, caption = get_apod.get_apod_image(date)
-        if image_data is None:
-            QMessageBox.warning(self, "Error", "No image found for the selected date.")
-            return
-        
-        self.save_file(image_data)
-
-        #display the image and text in the app
-        pixmap = QPixmap()
-        pixmap.loadFromData(image_data)
-        scaled_pixmap = pixmap.scaledToWidth(780, Qt.SmoothTransformation)
-        self.image_label.setPixmap(scaled_pixmap)
-        self.text_area.setText(f"{title}\n\n{caption}")
-
-        self.save_button.setFocus()
+        self.load_image(date)
 
 
 
     def save_button_clicked(self):
-        if hasattr(self, 'image_path') and os.path.exists(self.image_path):
-            try:
-                ctypes.windll.user32.SystemParametersInfoW(20, 0, self.image_path, 3)
-            except Exception as e:
-                QMessageBox.warning(self, "Error", "Failed to set wallpaper.")
+        if self.hd_pending:
+            QMessageBox.information(self, "Please Wait", "The full resolution image is still downloading.")
+        elif hasattr(self, 'image_path') and os.path.exists(self.image_path):
+            self.set_wallpaper(self.image_path, self.image_date)
         else:
             QMessageBox.warning(self, "Error", "No image available to set as wallpaper.")
 
 
 
+    #Fit the image to the connected screens and set it as the wallpaper in the background
+    # daily marks the scheduled update as done once the wallpaper has been set, stand_in is the
+    # date that was asked for when a cached image is standing in for it
+    def set_wallpaper(self, image_path, date, daily=False, stand_in=None):
+        fit_mode = self.fit_group.checkedAction().data()
+        task = WallpaperTask(self.wallpaper_backend, image_path, date, renditions.screen_geometries(), fit_mode)
+        if daily:
+            task.signals.finished.connect(lambda path: self.on_daily_update_applied(path, stand_in))
+            task.signals.failed.connect(self.on_daily_update_failed)
+        else:
+            task.signals.failed.connect(self.on_wallpaper_failed)
+        self.thread_pool.start(task)
+
+
+
+    def on_wallpaper_failed(self, message):
+        QMessageBox.warning(self, "Error", f"Failed to set wallpaper.\n\n{message}")
+
+
+
     def exit_button_clicked(self):
         msg = QMessageBox()
         font = QFont("Consolas", 12)
@@ -311,7 +401,7 @@ It may take a few seconds for the image to appear in the app since it is being d
 It is also possible, but rare, that the selected date is a video instead of an image.  If this happens, you will be notified with a message box.
                                     
 
-The app will automatically update the wallpaper every day at 9:00 AM using the current or random image, depending on the selected radio button.
+The app will automatically update the wallpaper every day at 9:00 AM using the current or random image, depending on the selected radio button.  The update time can be changed in the box next to the radio buttons.  The image is downloaded ahead of time, and an update missed while the computer was asleep is made up when it wakes.
                                     
 The random image will be selected from a date between June 16, 1995 and the current date.
                                     
@@ -402,37 +492,227 @@ jason.ace72@gmail.com
 
 
 
-    #Update the wallpaper automatically every day at 9:00 AM using the current or random image
-    def auto_update_wallpaper(self):
-        print("Running auto update wallpaper")
-        mode = "current" if self.current_radio.isChecked() else "random"
-        date = get_apod.get_daily_image(mode=mode)
-        image_data, title, caption = get_apod.get_apod_image(date)
-        if image_data is None:
-            QMessageBox.warning(self, "Error", "No image found for the selected date.")
+    #Browse a date range as thumbnails, double click one to show it here
+    def show_gallery(self):
+        if self.gallery_dialog is None:
+            self.gallery_dialog = GalleryDialog(self)
+            self.gallery_dialog.date_selected.connect(self.load_image)
+        self.gallery_dialog.show()
+        self.gallery_dialog.raise_()
+
+
+
+    #Search the archive by title and explanation, a result can be shown or set as the wallpaper
+    def show_search(self):
+        if self.search_dialog is None:
+            self.search_dialog = SearchDialog(self)
+            self.search_dialog.date_selected.connect(self.load_image)
+            self.search_dialog.wallpaper_requested.connect(lambda date: self.load_image(date, set_wallpaper=True))
+        self.search_dialog.show()
+        self.search_dialog.raise_()
+
+
+
+    #Start or stop the wallpaper rotation for the playlist picked in the menu
+    def rotation_source_changed(self, action):
+        source = action.data()
+        if source == "off":
+            self.rotation.stop()
+            self.statusBar().showMessage("Wallpaper rotation stopped.", 5000)
             return
-        
-        self.save_file(image_data)
+
+        if source == "random":
+            playlist = rotation.Playlist(name="random picks")
+        else:
+            if source == "gallery":
+                dates = self.gallery_dialog.image_dates() if self.gallery_dialog is not None else []
+                name = "the gallery range"
+            else:
+                dates = self.search_dialog.result_dates() if self.search_dialog is not None else []
+                name = "the search results"
+            if not dates:
+                QMessageBox.information(self, "Wallpaper Rotation", f"There are no images in {name} yet.")
+                self.rotation_group.actions()[0].setChecked(True)
+                self.rotation.stop()
+                return
+            playlist = rotation.Playlist(dates, name=name)
+
+        fit_mode = self.fit_group.checkedAction().data()
+        self.rotation.start(playlist, renditions.screen_geometries(), fit_mode)
+        self.statusBar().showMessage(f"Rotating the wallpaper through {playlist.name}...", 5000)
+
+
+
+    def on_rotation_switched(self, date, title):
+        self.statusBar().showMessage(f"Wallpaper: {date} {title}", 10000)
+
+
+
+    def on_rotation_failed(self, message):
+        self.statusBar().showMessage(f"Wallpaper rotation is waiting: {message}", 10000)
+
+
+
+    def show_stats(self):
+        stats_dialog = QDialog()
+        stats_dialog.setWindowTitle("Pipeline Stats")
+        stats_dialog.resize(650, 400)
+
+        stats_text = QTextEdit()
+        stats_text.setReadOnly(True)
+        stats_text.setFont(QFont('Consolas', 10))
+        stats_text.setPlainText(instrument.format_stats())
+
+        layout = QVBoxLayout()
+        layout.addWidget(stats_text)
+        stats_dialog.setLayout(layout)
+        stats_dialog.exec_()
+
+
+
+    #Update the wallpaper automatically every day using the current or random image
+    # With a date (usually prefetched by the scheduler) the update is a local operation
+    def auto_update_wallpaper(self, date=None):
+        instrument.logger.info("Running auto update wallpaper")
+        mode = self.daily_mode()
+        # The date is picked on the worker thread, random mode may need to update the image index
+        self.load_image(date, set_wallpaper=True, daily_mode=None if date else mode, daily=True)
+
+
+
+    def daily_mode(self):
+        return "current" if self.current_radio.isChecked() else "random"
+
+
+
+    #Start loading an image in the background, superseding any request still in flight
+    # With daily_mode the date is left as None and picked by get_apod.get_daily_image in the background
+    def load_image(self, date, set_wallpaper=False, daily_mode=None, daily=False):
+        # A daily wallpaper update is left to finish, it only loses the display
+        if self.current_loader is not None and not self.current_loader.set_wallpaper:
+            self.current_loader.cancel()
+        self.stop_revalidating()
+
+        self.request_id += 1
+        loader = ImageLoader(self.request_id, date, set_wallpaper,
+                             progressive=self.progressive_action.isChecked(), daily_mode=daily_mode, daily=daily)
+        loader.signals.preview_ready.connect(self.on_preview_loaded)
+        loader.signals.finished.connect(self.on_image_loaded)
+        loader.signals.failed.connect(self.on_image_failed)
+        loader.signals.progress.connect(self.on_image_progress)
+        self.current_loader = loader
+        self.thread_pool.start(loader)
+        self.statusBar().showMessage(f"Loading the image for {date or 'today'}...")
+
+
+
+    #Show the standard resolution preview, Set As Wallpaper waits for the HD image
+    def on_preview_loaded(self, request_id, result):
+        if request_id != self.request_id:
+            return
+        self.hd_pending = True
+        self.statusBar().showMessage(f"Showing a preview, downloading the full resolution image for {result.date}...")
+
+        self.image_label.setPixmap(QPixmap.fromImage(result.preview))
+        self.text_area.setText(f"{result.title}\n\n{result.caption}")
+
+
+
+    def on_image_loaded(self, request_id, result):
+        if request_id != self.request_id:
+            # A superseded daily update still changes the wallpaper without touching the display
+            if result.set_wallpaper:
+                self.set_wallpaper(result.image_path, result.date, daily=result.daily, stand_in=result.requested)
+            return
+        self.current_loader = None
+        self.hd_pending = False
+        self.statusBar().clearMessage()
+        self.progress_bar.hide()
+
+        self.image_path = result.image_path
+        self.image_date = result.date
 
         #display the image and text in the app
-        pixmap = QPixmap()
-        pixmap.loadFromData(image_data)
-        scaled_pixmap = pixmap.scaledToWidth(780, Qt.SmoothTransformation)
-        self.image_label.setPixmap(scaled_pixmap)
-        self.text_area.setText(f"{title}\n\n{caption}")
-        
-        # Set the wallpaper using the Windows API
-        ctypes.windll.user32.SystemParametersInfoW(20, 0, self.image_path, 3)
+        self.image_label.setPixmap(QPixmap.fromImage(result.preview))
+        self.text_area.setText(f"{result.title}\n\n{result.caption}")
+        self.save_button.setFocus()
+
+        if result.set_wallpaper:
+            self.set_wallpaper(self.image_path, self.image_date, daily=result.daily, stand_in=result.requested)
+
+        if result.requested:
+            self.statusBar().showMessage(f"NASA can't be reached, showing the cached image for {result.date}. "
+                                         f"{result.requested} will load when the connection is back.")
+            self.revalidate = (result.requested, result.set_wallpaper, result.daily)
+            self.revalidate_timer.start()
+
+
+
+    #Try the request that was served from the cache again, in the background
+    def revalidate_cached(self):
+        if self.revalidate is None or self.revalidate_running:
+            return
+        self.revalidate_running = True
+        task = RevalidateTask(self.revalidate[0])
+        task.signals.finished.connect(self.on_revalidated)
+        task.signals.failed.connect(self.on_revalidate_failed)
+        self.thread_pool.start(task)
+
+
+
+    #The image is in the cache now, so loading it again doesn't touch the network
+    def on_revalidated(self, date):
+        self.revalidate_running = False
+        if self.revalidate is not None and self.revalidate[0] == date:
+            date, set_wallpaper, daily = self.revalidate
+            self.load_image(date, set_wallpaper, daily=daily)
+
+
+
+    def on_revalidate_failed(self, message, retry):
+        self.revalidate_running = False
+        instrument.logger.info(f"Revalidation failed: {message}")
+        if not retry:
+            # Nothing to wait for, such as a video day, so the stand-in is kept
+            if self.revalidate is not None and self.revalidate[2] and self.schedule.stand_in == self.revalidate[0]:
+                self.schedule.mark_applied()
+            self.stop_revalidating()
 
-            
 
-    #Save the image to a temporary location
-    # This is used to set the wallpaper and display the image in the app
-    def save_file(self, image_data):
-        # Save the image to a temporary location
-        self.image_path = os.path.join(os.getenv('TEMP'), "apod_wallpaper.jpg")
-        with open(self.image_path, 'wb') as f:
-            f.write(image_data)
+
+    def stop_revalidating(self):
+        self.revalidate = None
+        self.revalidate_timer.stop()
+
+
+
+    #Sizes are shown in KB so they fit the progress bar's int range
+    def on_image_progress(self, request_id, done, total):
+        if request_id != self.request_id:
+            return
+        if total:
+            self.progress_bar.setRange(0, total // 1024)
+            self.progress_bar.setValue(done // 1024)
+        else:
+            # Unknown size, show a busy indicator
+            self.progress_bar.setRange(0, 0)
+        self.progress_bar.show()
+
+
+
+    def on_image_failed(self, request_id, message):
+        if request_id != self.request_id:
+            return
+        daily = self.current_loader is not None and self.current_loader.daily
+        self.current_loader = None
+        self.hd_pending = False
+        self.statusBar().clearMessage()
+        self.progress_bar.hide()
+        # The scheduler retries a failed daily update, so don't pop up a box each time
+        if daily:
+            self.on_daily_update_failed(message)
+        else:
+            QMessageBox.warning(self, "Error", f"No image found for the selected date.\n\n{message}")
 
 
     
@@ -460,29 +740,69 @@ jason.ace72@gmail.com
             self.show_normal_window()
         
 
-    def setup_daily_timer(self, target_time_str):
-        # Parse target time
-        target_time = QTime.fromString(target_time_str, "HH:mm")
-
-        # Current time
-        now = QTime.currentTime()
-        msecs_until = now.msecsTo(target_time)
+    #Check the daily schedule every minute
+    # Polling the wall clock, instead of one long single-shot timer, keeps the update on time
+    # across sleep/resume and catches up on an update missed while the machine was asleep.
+    def setup_daily_timer(self, target_time_str=None):
+        self.schedule = scheduler.DailySchedule(target_time_str)
+        self.prefetch_running = False
 
-        # If the target time already passed today, schedule for tomorrow
-        if msecs_until < 0:
-            msecs_until += 24 * 60 * 60 * 1000  # add 24 hours
+        self.daily_time_edit.setTime(QTime.fromString(self.schedule.time, "HH:mm"))
+        self.daily_time_edit.timeChanged.connect(self.daily_time_changed)
 
-        # Single-shot timer to run once at target time
         self.daily_timer = QTimer(self)
-        self.daily_timer.setSingleShot(True)
-        self.daily_timer.timeout.connect(self.run_daily_update)
-        self.daily_timer.start(msecs_until)
+        self.daily_timer.timeout.connect(self.check_schedule)
+        self.daily_timer.start(60 * 1000)
+        self.check_schedule()
+
+
+
+    def daily_time_changed(self, time):
+        self.schedule.set_time(time.toString("HH:mm"))
+
+
+
+    def check_schedule(self):
+        # The rotation owns the wallpaper while it runs
+        if self.rotation.active:
+            return
+        now = datetime.now()
+        mode = self.daily_mode()
+        if self.schedule.is_due(now):
+            self.run_daily_update()
+        elif self.schedule.stand_in and self.revalidate is None:
+            # The last update used a cached image, apply the real one once NASA is back
+            self.revalidate = (self.schedule.stand_in, True, True)
+            self.revalidate_timer.start()
+            self.revalidate_cached()
+        elif not self.prefetch_running and self.schedule.prefetch_due(mode, now):
+            # Fetch the next pick into the cache so the update itself doesn't need the network
+            self.prefetch_running = True
+            task = PrefetchTask(self.schedule, mode)
+            task.signals.finished.connect(self.on_prefetch_done)
+            task.signals.failed.connect(self.on_prefetch_done)
+            self.thread_pool.start(task)
+
+
+
+    def on_prefetch_done(self, message):
+        self.prefetch_running = False
+        instrument.logger.info(f"Daily prefetch: {message}")
     
 
     def run_daily_update(self):
-        self.auto_update_wallpaper()
-        # Set timer again for the next day
-        self.setup_daily_timer("09:00")
+        date = self.schedule.take(self.daily_mode(), datetime.now())
+        self.auto_update_wallpaper(date)
+
+
+
+    def on_daily_update_applied(self, path, stand_in=None):
+        self.schedule.mark_applied(stand_in=stand_in)
+
+
+
+    def on_daily_update_failed(self, message):
+        self.statusBar().showMessage(f"Daily wallpaper update failed, it will be retried: {message}", 10000)
 
 
 
@@ -502,10 +822,11 @@ def resource_path(relative_path):
 
 
 if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s %(levelname)s %(message)s")
     app = QApplication(sys.argv)
     app.setWindowIcon(QIcon(resource_path("images/saturn.ico")))
     window= MainWindow()
     window.show()
     #start_daily_scheduler(window)
-    window.setup_daily_timer("09:00")
+    window.setup_daily_timer()
     sys.exit(app.exec_())
\ No newline at end of file
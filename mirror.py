@@ -0,0 +1,203 @@
+import os
+import json
+import time
+import shutil
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from urllib.parse import urlparse
+
+import apod_cache
+import get_apod
+import instrument
+
+
+
+# Images downloaded at the same time, the image host is not covered by the API quota
+DEFAULT_WORKERS = 8
+# The manifest is written after this many new entries, so an interrupted sync loses little work
+MANIFEST_SAVE_EVERY = 50
+
+
+
+def manifest_path(folder):
+    return os.path.join(folder, "manifest.json")
+
+
+
+#Mirrored images are named by date and kept in one folder per year
+def mirror_file(date, url):
+    ext = os.path.splitext(urlparse(url).path)[1].lower() or ".jpg"
+    return os.path.join(date[:4], f"{date}{ext}")
+
+
+
+#Local copy of the image archive for a date range, for machines that run offline
+# manifest.json in the mirror folder maps each date to its file, size, mtime and SHA-256.  An
+# entry whose file still has the recorded size and mtime is skipped without reading it, so
+# re-syncing an up to date mirror only costs the metadata lookups (which come from the cache).
+# verify=True hashes every file again and downloads the ones that don't match.  Downloads go
+# through get_apod.download_file, so a sync that is interrupted resumes its .part files.
+class Mirror:
+    def __init__(self, folder, hd=True):
+        self.folder = folder
+        self.hd = hd
+        self.manifest = {}
+        self.load()
+
+    def load(self):
+        try:
+            with open(manifest_path(self.folder), 'r', encoding='utf-8') as f:
+                self.manifest = json.load(f).get('entries', {})
+        except (OSError, ValueError):
+            self.manifest = {}
+
+    def save(self):
+        data = {'hd': self.hd, 'entries': self.manifest}
+        apod_cache.atomic_write(manifest_path(self.folder), json.dumps(data, indent=1, sort_keys=True).encode('utf-8'))
+
+    #True if the date's file is in the mirror and matches its manifest entry
+    def is_current(self, date, verify=False):
+        entry = self.manifest.get(date)
+        if entry is None:
+            return False
+        if entry.get('media_type') != 'image':
+            return True
+        path = os.path.join(self.folder, entry['file'])
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return False
+        if stat.st_size != entry['size']:
+            return False
+        if verify or stat.st_mtime != entry['mtime']:
+            return apod_cache.file_sha256(path) == entry['sha256']
+        return True
+
+    #Fetch one image into the mirror and return its manifest entry, runs on a worker thread
+    # An image that is already in the cache is copied instead of downloaded.
+    def fetch(self, data):
+        url = get_apod.image_url(data, self.hd)
+        relative = mirror_file(data['date'], url)
+        path = os.path.join(self.folder, relative)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        downloaded = 0
+        cached = get_apod.find_image_file(data, self.hd)
+        with instrument.stage("mirror", date=data['date']) as timer:
+            if cached is not None:
+                _copy(cached, path)
+            else:
+                get_apod.download_file(url, path)
+                downloaded = os.path.getsize(path)
+            stat = os.stat(path)
+            timer.set(bytes=downloaded)
+        instrument.count("bytes_mirrored", downloaded)
+
+        entry = {'media_type': 'image', 'file': relative, 'url': url, 'size': stat.st_size,
+                 'mtime': stat.st_mtime, 'sha256': apod_cache.file_sha256(path)}
+        return entry, downloaded
+
+    #Bring the mirror up to date for start_date through end_date (inclusive)
+    # progress(stats) is called on the calling thread after every date.  Dates that fail are left
+    # out of the manifest and tried again by the next sync.  Returns a MirrorStats.
+    def sync(self, start_date, end_date, workers=DEFAULT_WORKERS, verify=False, progress=None):
+        stats = MirrorStats()
+        unsaved = 0
+        pending = {}
+
+        def collect(done):
+            nonlocal unsaved
+            for future in done:
+                data = pending.pop(future)
+                try:
+                    entry, downloaded = future.result()
+                except (get_apod.ApodError, OSError) as e:
+                    instrument.logger.warning(f"Could not mirror {data['date']}: {e}")
+                    stats.failed.append(data['date'])
+                    continue
+                self.manifest[data['date']] = entry
+                stats.fetched += 1
+                stats.bytes += downloaded
+                unsaved += 1
+                if progress is not None:
+                    progress(stats)
+            if unsaved >= MANIFEST_SAVE_EVERY:
+                self.save()
+                unsaved = 0
+
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="mirror") as executor:
+            try:
+                for data in get_apod.get_apod_range(start_date, end_date):
+                    stats.records += 1
+                    date = data['date']
+                    if data.get('media_type') != 'image':
+                        if date not in self.manifest:
+                            self.manifest[date] = {'media_type': data.get('media_type'), 'url': data.get('url')}
+                            unsaved += 1
+                        continue
+                    if self.is_current(date, verify):
+                        stats.skipped += 1
+                        if progress is not None:
+                            progress(stats)
+                        continue
+
+                    pending[executor.submit(self.fetch, data)] = data
+                    # Keep the queue short so metadata and downloads overlap without piling up
+                    if len(pending) >= workers * 2:
+                        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                        collect(done)
+
+                while pending:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    collect(done)
+            finally:
+                for future in pending:
+                    future.cancel()
+                self.save()
+
+        stats.seconds = time.perf_counter() - stats.started
+        return stats
+
+
+
+#Counts for one sync, bytes only includes what was downloaded
+class MirrorStats:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.seconds = 0.0
+        self.records = 0
+        self.fetched = 0
+        self.skipped = 0
+        self.bytes = 0
+        self.failed = []
+
+    @property
+    def elapsed(self):
+        return self.seconds or time.perf_counter() - self.started
+
+    @property
+    def mb_per_s(self):
+        return self.bytes / self.elapsed / 1e6 if self.elapsed else 0.0
+
+    @property
+    def images_per_s(self):
+        return self.fetched / self.elapsed if self.elapsed else 0.0
+
+    def summary(self):
+        return (f"{self.records} records, {self.fetched} images fetched, {self.skipped} up to date, "
+                f"{len(self.failed)} failed, {self.bytes / 1e6:.1f} MB in {self.elapsed:.1f}s "
+                f"({self.mb_per_s:.1f} MB/s, {self.images_per_s:.1f} images/s)")
+
+
+
+#Copy through a temp name so an interrupted copy never looks like a complete file
+# A hard link would share the cache's mtime, which the cache touches on every use.
+def _copy(source, path):
+    part_path = path + ".part"
+    shutil.copyfile(source, part_path)
+    os.replace(part_path, path)
+
+
+
+#Mirror a date range into folder, see Mirror.sync
+def sync_mirror(folder, start_date, end_date, workers=DEFAULT_WORKERS, hd=True, verify=False, progress=None):
+    return Mirror(folder, hd).sync(start_date, end_date, workers, verify, progress)
@@ -0,0 +1,373 @@
+import os
+import json
+import mmap
+import struct
+import threading
+from datetime import datetime, timedelta
+
+import apod_cache
+
+# numpy is optional, without it the filters walk the records one at a time
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+
+# Same archive start as get_apod, kept here because get_apod imports this module
+START_DATE = datetime(1995, 6, 16)
+
+MAGIC = b"APODREC1"
+HEADER = struct.Struct("<8sIIi44x")
+# flags, media type, width, height, file size, hash, text offset, text length, then the
+# wallpaper score and the image features it was computed from (see scoring.py), 0 when unscored
+RECORD = struct.Struct("<BBHHIQIIBBBBB1x")
+FEATURES = ('score', 'brightness', 'contrast', 'edges', 'colourfulness')
+EMPTY = RECORD.unpack(bytes(RECORD.size))
+# Room for this many days past today is allocated whenever the file grows
+GROW_DAYS = 366
+
+# Flags
+KNOWN = 0x01
+HAS_HD = 0x02
+HD_CACHED = 0x04
+SD_CACHED = 0x08
+
+MEDIA_UNKNOWN = 0
+MEDIA_IMAGE = 1
+MEDIA_VIDEO = 2
+MEDIA_OTHER = 3
+MEDIA_TYPES = {'image': MEDIA_IMAGE, 'video': MEDIA_VIDEO}
+MEDIA_NAMES = {MEDIA_IMAGE: 'image', MEDIA_VIDEO: 'video', MEDIA_OTHER: 'other'}
+
+if numpy is not None:
+    RECORD_DTYPE = numpy.dtype([('flags', 'u1'), ('media', 'u1'), ('width', '<u2'), ('height', '<u2'),
+                                ('file_size', '<u4'), ('hash', '<u8'), ('text_offset', '<u4'),
+                                ('text_length', '<u4'), ('score', 'u1'), ('brightness', 'u1'),
+                                ('contrast', 'u1'), ('edges', 'u1'), ('colourfulness', 'u1'),
+                                ('reserved', 'V1')])
+    assert RECORD_DTYPE.itemsize == RECORD.size
+
+
+
+def store_folder():
+    return os.path.join(apod_cache.cache_dir(), "records")
+
+
+
+#Day offset of a date from the start of the archive, the date can be a string or a datetime
+def day_of(date):
+    if isinstance(date, str):
+        date = datetime.strptime(date, '%Y-%m-%d')
+    return (datetime(date.year, date.month, date.day) - START_DATE).days
+
+
+
+def date_of(day):
+    return (START_DATE + timedelta(days=int(day))).strftime('%Y-%m-%d')
+
+
+
+#First 64 bits of the SHA-256 of a file, enough to tell a changed or corrupted file apart
+def file_hash(path):
+    return int.from_bytes(bytes.fromhex(apod_cache.file_sha256(path))[:8], 'little')
+
+
+
+#Fixed width record per APOD day in a memory-mapped file, indexed by day offset from 1995-06-16
+# records.bin holds a small header and one 32 byte record per day: media type, image width and
+# height, file size, cache state, a file hash and the wallpaper score.  The full metadata of
+# each day is kept as a JSON string in the append-only strings.bin, and is only parsed when that
+# day is looked up.
+# Opening the store maps the file and reads nothing, a lookup is one seek and filters over the
+# whole archive run on the mapped array with numpy when it is installed.
+class RecordStore:
+    def __init__(self, folder=None):
+        self.folder = folder or store_folder()
+        self.lock = threading.RLock()
+        self.file = None
+        self.map = None
+        self.strings = None
+        self.array = None
+        self.capacity = 0
+        # Bumped on every change so callers can cache filter results
+        self.version = 0
+
+    def open(self):
+        if self.map is not None:
+            return
+        os.makedirs(self.folder, exist_ok=True)
+        path = os.path.join(self.folder, "records.bin")
+        self.file = open(path, 'r+b' if os.path.exists(path) else 'w+b')
+        size = os.fstat(self.file.fileno()).st_size
+        if size < HEADER.size:
+            self.file.write(HEADER.pack(MAGIC, RECORD.size, 0, -1))
+            self.file.flush()
+        else:
+            magic, record_size = HEADER.unpack(self.file.read(HEADER.size))[:2]
+            if magic != MAGIC or record_size != RECORD.size:
+                raise ValueError(f"{path} is not a record store of this version")
+        self.strings = open(os.path.join(self.folder, "strings.bin"), 'a+b')
+        self._map(day_of(datetime.today()) + GROW_DAYS)
+
+    def close(self):
+        with self.lock:
+            if self.map is not None:
+                self.array = None
+                self.map.close()
+                self.file.close()
+                self.strings.close()
+                self.map = None
+
+    #Map the file with room for at least days records, growing it if it is shorter
+    def _map(self, days):
+        # Windows can't resize a file with a mapped view, so the old map goes before the truncate.
+        # The numpy view holds a reference to the map, drop it first.
+        if self.map is not None:
+            self.array = None
+            self.map.close()
+            self.map = None
+        size = os.fstat(self.file.fileno()).st_size
+        needed = HEADER.size + days * RECORD.size
+        if size < needed:
+            self.file.truncate(needed)
+            size = needed
+        self.map = mmap.mmap(self.file.fileno(), size)
+        self.capacity = (size - HEADER.size) // RECORD.size
+        if numpy is not None:
+            self.array = numpy.frombuffer(self.map, dtype=RECORD_DTYPE, count=self.capacity, offset=HEADER.size)
+
+    #Position of a day's record, the map is extended for days past the end
+    def _offset(self, day, grow=False):
+        if day < 0:
+            raise ValueError(f"{date_of(day)} is before the first APOD")
+        if day >= self.capacity:
+            # Another process may have grown the file already
+            if not grow and HEADER.size + (day + 1) * RECORD.size > os.fstat(self.file.fileno()).st_size:
+                return None
+            self._map(day + GROW_DAYS)
+        return HEADER.size + day * RECORD.size
+
+    def _read(self, date):
+        self.open()
+        offset = self._offset(day_of(date))
+        if offset is None:
+            return None
+        return list(RECORD.unpack_from(self.map, offset))
+
+    def _write(self, date, record):
+        offset = self._offset(day_of(date), grow=True)
+        RECORD.pack_into(self.map, offset, *record)
+        self.version += 1
+
+    #Add APOD metadata records, returns the number of dates that were new to the store
+    # Past entries never change, so a date that is already known is left as it is.
+    def add_records(self, records):
+        added = 0
+        with self.lock:
+            self.open()
+            for data in records:
+                record = self._read(data['date']) or list(EMPTY)
+                if record[0] & KNOWN:
+                    continue
+                text = json.dumps(data).encode('utf-8')
+                # Appending from another process moves the end, so take the offset after the write
+                self.strings.write(text)
+                self.strings.flush()
+                text_offset = self.strings.tell() - len(text)
+
+                flags = record[0] | KNOWN
+                if 'hdurl' in data and data['hdurl'] != data.get('url'):
+                    flags |= HAS_HD
+                media = MEDIA_TYPES.get(data.get('media_type'), MEDIA_OTHER)
+                self._write(data['date'], [flags, media] + record[2:6] + [text_offset, len(text)] + record[8:])
+                added += 1
+        return added
+
+    #The metadata dict for a date, None if it isn't in the store
+    def metadata(self, date):
+        with self.lock:
+            record = self._read(date)
+            if record is None or not record[0] & KNOWN or not record[7]:
+                return None
+            self.strings.seek(record[6])
+            text = self.strings.read(record[7])
+        try:
+            return json.loads(text)
+        except ValueError:
+            return None
+
+    #'image', 'video' or 'other', None if the date isn't known
+    def media_type(self, date):
+        with self.lock:
+            record = self._read(date)
+        if record is None or not record[1]:
+            return None
+        return MEDIA_NAMES[record[1]]
+
+    #Record the media type of a date whose metadata isn't at hand
+    def set_media_type(self, date, media_type):
+        with self.lock:
+            record = self._read(date) or list(EMPTY)
+            if not record[1]:
+                record[1] = MEDIA_TYPES.get(media_type, MEDIA_OTHER)
+                self._write(date, record)
+
+    def size(self, date):
+        with self.lock:
+            record = self._read(date)
+        if record is None or not record[2]:
+            return None
+        return record[2], record[3]
+
+    def set_size(self, date, width, height):
+        with self.lock:
+            record = self._read(date) or list(EMPTY)
+            record[1] = MEDIA_IMAGE
+            record[2:4] = min(width, 0xFFFF), min(height, 0xFFFF)
+            self._write(date, record)
+
+    #Byte size and hash of the downloaded HD image, None if it hasn't been downloaded
+    def file_info(self, date):
+        with self.lock:
+            record = self._read(date)
+        if record is None or not record[4]:
+            return None
+        return record[4], record[5]
+
+    def set_file_info(self, date, byte_size, hash_value):
+        with self.lock:
+            record = self._read(date) or list(EMPTY)
+            record[4:6] = min(byte_size, 0xFFFFFFFF), hash_value
+            self._write(date, record)
+
+    def set_cached(self, date, hd=True, cached=True):
+        flag = HD_CACHED if hd else SD_CACHED
+        with self.lock:
+            record = self._read(date)
+            if record is None:
+                if not cached:
+                    return
+                record = list(EMPTY)
+            flags = record[0] | flag if cached else record[0] & ~flag
+            if flags != record[0]:
+                record[0] = flags
+                self._write(date, record)
+
+    #Wallpaper score and features of an image as a dict of 1-255 values, None if it isn't scored
+    def features(self, date):
+        with self.lock:
+            record = self._read(date)
+        if record is None or not record[8]:
+            return None
+        return dict(zip(FEATURES, record[8:13]))
+
+    def set_features(self, date, features):
+        with self.lock:
+            record = self._read(date) or list(EMPTY)
+            record[8:13] = [max(1, min(255, features[name])) for name in FEATURES]
+            self._write(date, record)
+
+    #Every date up to this one has been checked against the API
+    @property
+    def synced_through(self):
+        with self.lock:
+            self.open()
+            day = HEADER.unpack_from(self.map, 0)[3]
+        return None if day < 0 else date_of(day)
+
+    @synced_through.setter
+    def synced_through(self, date):
+        with self.lock:
+            self.open()
+            HEADER.pack_into(self.map, 0, MAGIC, RECORD.size, 0, -1 if date is None else day_of(date))
+            self.version += 1
+
+    def flush(self):
+        with self.lock:
+            if self.map is not None:
+                self.map.flush()
+
+    #Day offsets of the images matching the filters, sizes must be known for the size filters to match
+    # Images that haven't been scored pass min_score.  With numpy this is one vectorized pass over
+    # the mapped array, otherwise a loop over the records.
+    def image_days(self, min_width=0, min_height=0, landscape=False, unsized=False, min_score=0):
+        with self.lock:
+            self.open()
+            if self.array is not None:
+                records = self.array
+                mask = records['media'] == MEDIA_IMAGE
+                if unsized:
+                    mask &= records['width'] == 0
+                elif min_width or min_height or landscape:
+                    mask &= (records['width'] >= max(min_width, 1)) & (records['height'] >= min_height)
+                    if landscape:
+                        mask &= records['width'] > records['height']
+                if min_score:
+                    mask &= (records['score'] == 0) | (records['score'] >= min_score)
+                return numpy.flatnonzero(mask).tolist()
+
+            days = []
+            for day in range(self.capacity):
+                record = RECORD.unpack_from(self.map, HEADER.size + day * RECORD.size)
+                media, width, height, score = record[1], record[2], record[3], record[8]
+                if media != MEDIA_IMAGE or (min_score and score and score < min_score):
+                    continue
+                if unsized:
+                    if width:
+                        continue
+                elif min_width or min_height or landscape:
+                    if not width or width < min_width or height < min_height or (landscape and width <= height):
+                        continue
+                days.append(day)
+            return days
+
+    #Scores of the given days, 0 for the ones that haven't been scored
+    def scores(self, days):
+        with self.lock:
+            self.open()
+            if self.array is not None:
+                return self.array['score'][days].tolist()
+            return [RECORD.unpack_from(self.map, HEADER.size + day * RECORD.size)[8] for day in days]
+
+    #Day offsets of cached images that haven't been scored yet
+    def unscored_days(self):
+        with self.lock:
+            self.open()
+            cached = HD_CACHED | SD_CACHED
+            if self.array is not None:
+                records = self.array
+                mask = (records['media'] == MEDIA_IMAGE) & ((records['flags'] & cached) != 0) & (records['score'] == 0)
+                return numpy.flatnonzero(mask).tolist()
+            days = []
+            for day in range(self.capacity):
+                record = RECORD.unpack_from(self.map, HEADER.size + day * RECORD.size)
+                if record[1] == MEDIA_IMAGE and record[0] & cached and not record[8]:
+                    days.append(day)
+            return days
+
+    #Day offsets whose image is in the cache
+    def cached_days(self, hd=True):
+        flag = HD_CACHED if hd else SD_CACHED
+        with self.lock:
+            self.open()
+            if self.array is not None:
+                return numpy.flatnonzero(self.array['flags'] & flag).tolist()
+            return [day for day in range(self.capacity)
+                    if RECORD.unpack_from(self.map, HEADER.size + day * RECORD.size)[0] & flag]
+
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+
+#The shared store in the cache folder
+def get_store():
+    global _store
+    with _store_lock:
+        if _store is None or _store.folder != store_folder():
+            _store = RecordStore()
+        return _store
@@ -0,0 +1,140 @@
+import os
+import tempfile
+
+from PyQt5.QtCore import Qt, QRect, QSize
+from PyQt5.QtGui import QImage, QImageReader, QPainter, QColor
+
+import apod_cache
+import image_store
+
+
+
+# fill scales the image to cover the screen and crops the overflow,
+# fit scales it to fit inside the screen and pads the rest with black
+FIT_FILL = "fill"
+FIT_FIT = "fit"
+FIT_MODES = (FIT_FILL, FIT_FIT)
+
+
+
+#Geometry of every connected screen in device pixels as (x, y, width, height)
+# Only valid on the GUI thread, pass the result to the functions below
+def screen_geometries():
+    from PyQt5.QtWidgets import QApplication
+
+    geometries = []
+    for screen in QApplication.screens():
+        rect = screen.geometry()
+        ratio = screen.devicePixelRatio()
+        geometries.append((round(rect.x() * ratio), round(rect.y() * ratio),
+                           round(rect.width() * ratio), round(rect.height() * ratio)))
+    return geometries
+
+
+
+#Decode the image and crop or pad it to exactly width x height
+# The decode happens at the target scale so a huge APOD is never fully expanded in memory
+def render(image_path, width, height, fit_mode=FIT_FILL):
+    reader = QImageReader(image_path)
+    reader.setAutoTransform(True)
+    source = reader.size()
+    if not source.isValid() or source.isEmpty():
+        return None
+
+    if fit_mode == FIT_FILL:
+        scale = max(width / source.width(), height / source.height())
+    else:
+        scale = min(width / source.width(), height / source.height())
+    scaled = QSize(max(1, round(source.width() * scale)), max(1, round(source.height() * scale)))
+
+    # QImageReader only downscales well, enlarge small images after decoding instead
+    if scale < 1:
+        reader.setScaledSize(scaled)
+    image = reader.read()
+    if image.isNull():
+        return None
+    if image.size() != scaled:
+        image = image.scaled(scaled, Qt.IgnoreAspectRatio, Qt.SmoothTransformation)
+
+    if fit_mode == FIT_FILL:
+        return image.copy(QRect((scaled.width() - width) // 2, (scaled.height() - height) // 2, width, height))
+
+    canvas = QImage(width, height, QImage.Format_RGB32)
+    canvas.fill(QColor(Qt.black))
+    painter = QPainter(canvas)
+    painter.drawImage((width - scaled.width()) // 2, (height - scaled.height()) // 2, image)
+    painter.end()
+    return canvas
+
+
+
+#Part of the rendition name that tells which file it was made from
+# A date can be rendered from its standard resolution image while the HD one isn't available,
+# so the date alone doesn't identify the source.  The hash is usually the one stored at download.
+def source_key(image_path, date):
+    return f"{image_store.content_hash(image_path, date):016x}"[:8]
+
+
+
+#Return a cached rendition of the image for one screen size, rendering it the first time
+def get_rendition(image_path, date, width, height, fit_mode=FIT_FILL, source=None):
+    source = source or source_key(image_path, date)
+    path = apod_cache.rendition_path(date, f"{width}x{height}", fit_mode, source)
+    if os.path.exists(path):
+        apod_cache.touch(path)
+        return path
+
+    image = render(image_path, width, height, fit_mode)
+    if image is None:
+        return None
+    return _save(image, path)
+
+
+
+#Build the wallpaper for the given screens and return (path, span)
+# One screen gets a rendition of its own size.  Several screens get one image covering the whole
+# virtual desktop, with a rendition for each screen placed at its position, to be set as spanned.
+def prepare_wallpaper(image_path, date, screens, fit_mode=FIT_FILL):
+    source = source_key(image_path, date)
+    if len(screens) == 1:
+        x, y, width, height = screens[0]
+        return get_rendition(image_path, date, width, height, fit_mode, source), False
+
+    left = min(x for x, y, w, h in screens)
+    top = min(y for x, y, w, h in screens)
+    right = max(x + w for x, y, w, h in screens)
+    bottom = max(y + h for x, y, w, h in screens)
+
+    size_key = "span_" + "_".join(f"{w}x{h}+{x - left}+{y - top}" for x, y, w, h in sorted(screens))
+    path = apod_cache.rendition_path(date, size_key, fit_mode, source)
+    if os.path.exists(path):
+        apod_cache.touch(path)
+        return path, True
+
+    canvas = QImage(right - left, bottom - top, QImage.Format_RGB32)
+    canvas.fill(QColor(Qt.black))
+    painter = QPainter(canvas)
+    for x, y, width, height in screens:
+        image = render(image_path, width, height, fit_mode)
+        if image is None:
+            painter.end()
+            return None, True
+        painter.drawImage(x - left, y - top, image)
+    painter.end()
+    return _save(canvas, path), True
+
+
+
+#Write atomically so the desktop never picks up a half-written file, then trim the renditions folder
+# The temp file has a unique name, two tasks may render the same wallpaper at once
+def _save(image, path):
+    folder = os.path.dirname(path)
+    os.makedirs(folder, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=folder, suffix=".tmp")
+    os.close(fd)
+    if not image.save(tmp_path, "JPG", 95):
+        os.remove(tmp_path)
+        return None
+    os.replace(tmp_path, path)
+    apod_cache.evict(apod_cache.RENDITIONS_MAX_MB * 1024 * 1024, keep=(path,), folder="renditions")
+    return path
@@ -0,0 +1,224 @@
+import random
+import threading
+from collections import deque
+
+from PyQt5.QtCore import QObject, QRunnable, QTimer, pyqtSignal
+
+import get_apod
+import image_store
+import instrument
+import renditions
+from wallpaper import WallpaperError
+
+
+
+# Wallpapers kept ready ahead of the one on screen
+BUFFER_SIZE = 3
+DEFAULT_INTERVAL_MINUTES = 15
+# Dates in a row that can fail to prepare before refilling waits for the next switch
+MAX_FAILURES = 5
+
+
+
+#Dates to rotate through, a fixed list (a date range or search results) or random picks
+# A list is played in order, or shuffled again on every pass with shuffle=True, and repeats.
+# next() may need the network for random picks, so it is only called from PrepareTask.
+class Playlist:
+    def __init__(self, dates=None, shuffle=False, name=""):
+        self.dates = list(dates) if dates is not None else None
+        self.shuffle = shuffle
+        self.name = name
+        self.order = []
+        self.position = 0
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.dates) if self.dates is not None else 0
+
+    def next(self):
+        if self.dates is None:
+            return get_apod.get_daily_image("random")
+        with self.lock:
+            if self.position >= len(self.order):
+                self.order = list(self.dates)
+                if self.shuffle:
+                    random.shuffle(self.order)
+                self.position = 0
+            date = self.order[self.position]
+            self.position += 1
+            return date
+
+
+
+#Everything needed to switch to a wallpaper without touching the network or decoding anything
+class PreparedWallpaper:
+    def __init__(self, date, title, path, span):
+        self.date = date
+        self.title = title
+        self.path = path
+        self.span = span
+
+
+
+class PrepareSignals(QObject):
+    finished = pyqtSignal(int, object)
+    failed = pyqtSignal(int, str)
+
+
+
+#Take the next date from the playlist, download it and render it at the screen size
+class PrepareTask(QRunnable):
+    def __init__(self, generation, playlist, screens, fit_mode):
+        super().__init__()
+        self.generation = generation
+        self.playlist = playlist
+        self.screens = screens
+        self.fit_mode = fit_mode
+        self.signals = PrepareSignals()
+
+    def run(self):
+        try:
+            date = self.playlist.next()
+            data = get_apod.get_image_metadata(date)
+            image_path = get_apod.get_image_file(data)
+            with instrument.stage("render", date=date, screens=len(self.screens), fit=self.fit_mode):
+                path, span = renditions.prepare_wallpaper(image_path, date, self.screens, self.fit_mode)
+        except (get_apod.ApodError, OSError) as e:
+            self.signals.failed.emit(self.generation, str(e))
+            return
+        if path is None:
+            self.signals.failed.emit(self.generation, f"The image for {date} could not be prepared for the screen.")
+            return
+        self.signals.finished.emit(self.generation, PreparedWallpaper(date, data['title'], path, span))
+
+
+
+class ApplySignals(QObject):
+    finished = pyqtSignal(object)
+    failed = pyqtSignal(str)
+
+
+
+#Hand a prepared wallpaper to the backend, off the GUI thread since the desktop may be slow to answer
+class ApplyTask(QRunnable):
+    def __init__(self, backend, wallpaper):
+        super().__init__()
+        self.backend = backend
+        self.wallpaper = wallpaper
+        self.signals = ApplySignals()
+
+    def run(self):
+        try:
+            path = image_store.set_current(self.wallpaper.path)
+            with instrument.stage("set_wallpaper", backend=self.backend.name, span=self.wallpaper.span):
+                self.backend.set_wallpaper(path, self.wallpaper.span)
+        except (WallpaperError, OSError) as e:
+            self.signals.failed.emit(str(e))
+            return
+        self.signals.finished.emit(self.wallpaper)
+
+
+
+#Switch the wallpaper through a playlist every few minutes
+# A ring buffer of BUFFER_SIZE wallpapers is kept downloaded and rendered ahead, refilled one at
+# a time in the background, so a switch only sets a file path.  generation goes up on every
+# start and stop so results from an earlier playlist are dropped.
+class Rotation(QObject):
+    switched = pyqtSignal(str, str)
+    failed = pyqtSignal(str)
+
+    def __init__(self, backend, thread_pool, parent=None):
+        super().__init__(parent)
+        self.backend = backend
+        self.thread_pool = thread_pool
+        self.buffer = deque(maxlen=BUFFER_SIZE)
+        self.generation = 0
+        self.playlist = None
+        self.screens = None
+        self.fit_mode = renditions.FIT_FILL
+        self.preparing = False
+        self.failures = 0
+        # A switch came due while the buffer was empty, switch as soon as one is ready
+        self.waiting = False
+        self.timer = QTimer(self)
+        self.timer.timeout.connect(self.advance)
+        self.set_interval(DEFAULT_INTERVAL_MINUTES)
+
+    @property
+    def active(self):
+        return self.playlist is not None
+
+    def set_interval(self, minutes):
+        self.timer.setInterval(int(minutes * 60 * 1000))
+
+    #Start rotating through playlist, screens comes from renditions.screen_geometries()
+    def start(self, playlist, screens, fit_mode=renditions.FIT_FILL):
+        self.stop()
+        self.playlist = playlist
+        self.screens = screens
+        self.fit_mode = fit_mode
+        self.waiting = True
+        self.timer.start()
+        self.fill()
+
+    def stop(self):
+        self.generation += 1
+        self.playlist = None
+        self.buffer.clear()
+        self.preparing = False
+        self.failures = 0
+        self.waiting = False
+        self.timer.stop()
+
+    #Prepare the next wallpaper if the buffer has room and nothing is being prepared
+    def fill(self):
+        if not self.active or self.preparing or len(self.buffer) >= BUFFER_SIZE:
+            return
+        if self.failures >= MAX_FAILURES:
+            return
+        self.preparing = True
+        task = PrepareTask(self.generation, self.playlist, self.screens, self.fit_mode)
+        task.signals.finished.connect(self.on_prepared)
+        task.signals.failed.connect(self.on_prepare_failed)
+        self.thread_pool.start(task)
+
+    def on_prepared(self, generation, wallpaper):
+        if generation != self.generation:
+            return
+        self.preparing = False
+        self.failures = 0
+        self.buffer.append(wallpaper)
+        if self.waiting:
+            self.advance()
+        else:
+            self.fill()
+
+    def on_prepare_failed(self, generation, message):
+        if generation != self.generation:
+            return
+        self.preparing = False
+        self.failures += 1
+        instrument.logger.info(f"Rotation skipped a date: {message}")
+        if self.failures >= MAX_FAILURES:
+            self.failed.emit(message)
+        self.fill()
+
+    #Switch to the next buffered wallpaper and refill behind it
+    def advance(self):
+        if not self.active:
+            return
+        if not self.buffer:
+            self.waiting = True
+            self.failures = 0
+            self.fill()
+            return
+        self.waiting = False
+        task = ApplyTask(self.backend, self.buffer.popleft())
+        task.signals.finished.connect(self.on_applied)
+        task.signals.failed.connect(self.failed)
+        self.thread_pool.start(task)
+        self.fill()
+
+    def on_applied(self, wallpaper):
+        if self.active:
+            self.switched.emit(wallpaper.date, wallpaper.title)
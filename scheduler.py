@@ -0,0 +1,169 @@
+import os
+import json
+import threading
+from datetime import datetime, timedelta
+
+import apod_cache
+import get_apod
+
+
+
+# Time of the daily wallpaper update, can be overridden with APOD_DAILY_TIME or saved from the app
+DEFAULT_DAILY_TIME = "09:00"
+# How long before the update the current mode starts polling for today's APOD
+PREFETCH_LEAD = timedelta(hours=3)
+# Wait between attempts when a prefetch or an update fails
+RETRY_INTERVAL = timedelta(minutes=15)
+
+
+
+def state_path():
+    return os.path.join(apod_cache.cache_dir(), "schedule.json")
+
+
+
+def parse_time(time_str):
+    hour, minute = (int(part) for part in time_str.split(":"))
+    if not (0 <= hour < 24 and 0 <= minute < 60):
+        raise ValueError(f"Invalid time '{time_str}', expected HH:MM.")
+    return hour, minute
+
+
+
+#Daily wallpaper schedule with prefetching and catch-up after missed runs
+# The state lives in a small JSON file so the app and the headless command share it:
+#   time          - "HH:MM" of the daily update
+#   last_applied  - the day of the last update that was applied, an update time that has
+#                   passed since then is due, which catches up on runs missed while asleep
+#   prefetched    - the APOD picked and downloaded ahead of time for the next update
+# Nothing here keeps time, the caller checks is_due()/prefetch_due() from a timer or a cron job.
+class DailySchedule:
+    def __init__(self, time_str=None, path=None):
+        self.path = path or state_path()
+        self.lock = threading.RLock()
+        self.state = self._load()
+        # Attempts are only throttled within one process
+        self.last_attempt = {}
+        if time_str:
+            self.set_time(time_str)
+        elif 'time' not in self.state:
+            self.state['time'] = os.getenv("APOD_DAILY_TIME") or DEFAULT_DAILY_TIME
+        parse_time(self.state['time'])
+        # On the first run wait for the next update time instead of changing the wallpaper right away
+        if 'last_applied' not in self.state:
+            self.state['last_applied'] = self.last_target_day(datetime.now()).isoformat()
+            self.save()
+
+    def _load(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def save(self):
+        with self.lock:
+            apod_cache.atomic_write(self.path, json.dumps(self.state).encode('utf-8'))
+
+    @property
+    def time(self):
+        return self.state['time']
+
+    def set_time(self, time_str):
+        parse_time(time_str)
+        with self.lock:
+            self.state['time'] = time_str
+            self.save()
+
+    def target(self, day):
+        hour, minute = parse_time(self.time)
+        return datetime(day.year, day.month, day.day, hour, minute)
+
+    #Day of the most recent update time that has passed
+    def last_target_day(self, now):
+        today = now.date()
+        if now >= self.target(today):
+            return today
+        return today - timedelta(days=1)
+
+    #Day the next update is for, a missed one counts until it has been applied
+    def next_day(self, now):
+        day = self.last_target_day(now)
+        last_applied = self.state.get('last_applied')
+        if last_applied is not None and last_applied >= day.isoformat():
+            return day + timedelta(days=1)
+        return day
+
+    def next_run(self, now):
+        return self.target(self.next_day(now))
+
+    #True once an update time has passed without an update, including one missed while suspended
+    def is_due(self, now):
+        return now >= self.next_run(now) and self._may_attempt('apply', now)
+
+    #True when the pick for the next update should be fetched now
+    # Random picks can be fetched any time before the update, the current APOD only once
+    # NASA may have published it, from PREFETCH_LEAD before the update time.
+    def prefetch_due(self, mode, now):
+        day = self.next_day(now)
+        if self.prefetched(mode, day) is not None:
+            return False
+        if mode == "current" and now < self.target(day) - PREFETCH_LEAD:
+            return False
+        return self._may_attempt('prefetch', now)
+
+    def _may_attempt(self, kind, now):
+        last = self.last_attempt.get(kind)
+        return last is None or now - last >= RETRY_INTERVAL
+
+    def attempted(self, kind, now):
+        self.last_attempt[kind] = now
+
+    #The APOD date prefetched for mode and day, None if there isn't one
+    def prefetched(self, mode, day):
+        entry = self.state.get('prefetched')
+        if entry and entry['mode'] == mode and entry['day'] == day.isoformat():
+            return entry['date']
+        return None
+
+    #Pick the APOD for the next update and download it into the cache
+    # Raises ApodError when it can't be fetched yet, for example before today's APOD is published.
+    def prefetch(self, mode, now=None):
+        now = now or datetime.now()
+        day = self.next_day(now)
+        self.attempted('prefetch', now)
+
+        if mode == "current":
+            date = day.isoformat()
+        else:
+            date = get_apod.get_daily_image("random")
+        data = get_apod.get_image_metadata(date)
+        get_apod.get_image_file(data)
+
+        with self.lock:
+            self.state['prefetched'] = {'mode': mode, 'day': day.isoformat(), 'date': date}
+            self.save()
+        return date
+
+    #The APOD date to apply now, the prefetched one when there is one, otherwise None
+    def take(self, mode, now):
+        self.attempted('apply', now)
+        return self.prefetched(mode, self.next_day(now))
+
+    #Record the update as done, stand_in is the date asked for when a cached image had to stand in
+    # for it because NASA couldn't be reached.  That date stays in stand_in until it is applied.
+    def mark_applied(self, now=None, stand_in=None):
+        now = now or datetime.now()
+        with self.lock:
+            self.state['last_applied'] = self.last_target_day(now).isoformat()
+            self.state.pop('prefetched', None)
+            if stand_in:
+                self.state['stand_in'] = stand_in
+            else:
+                self.state.pop('stand_in', None)
+            self.save()
+        self.last_attempt.pop('apply', None)
+
+    @property
+    def stand_in(self):
+        return self.state.get('stand_in')
@@ -0,0 +1,156 @@
+import os
+import math
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy
+
+import get_apod
+import instrument
+import record_store
+
+
+
+#How well an image will work as a wallpaper, from cheap features of a small decode
+# Tiny images, extreme aspect ratios, charts and text (sharp edges on a flat background, few
+# colours) and washed-out frames score low.  Scores and features are stored as 1-255 values in
+# the record store, so random mode can weight its picks without decoding anything.
+
+# Images are decoded at this width for scoring
+SCORE_WIDTH = 256
+# Resolution that counts as full marks
+FULL_PIXELS = 1920 * 1080
+# Aspect ratio the aspect score peaks at
+IDEAL_ASPECT = 16 / 9
+# Luminance steps larger than this count as edges
+EDGE_THRESHOLD = 0.2
+
+
+
+#Features and score of an RGB image array, width and height are the size of the original image
+# Every value is a float from 0 to 1.
+def image_features(rgb, width, height):
+    pixels = rgb.astype(numpy.float32) / 255
+    red, green, blue = pixels[..., 0], pixels[..., 1], pixels[..., 2]
+    luminance = 0.2126 * red + 0.7152 * green + 0.0722 * blue
+
+    brightness = float(luminance.mean())
+    contrast = float(luminance.std())
+
+    # Share of pixels on a sharp luminance step, high for text, diagrams and charts
+    step_x = numpy.abs(numpy.diff(luminance, axis=1))[:-1, :]
+    step_y = numpy.abs(numpy.diff(luminance, axis=0))[:, :-1]
+    edges = float(((step_x + step_y) > EDGE_THRESHOLD).mean())
+
+    # Share of the image covered by its four most common colours (3 bits per channel),
+    # close to 1 for flat graphics, much lower for photographs
+    quantized = (rgb >> 5).astype(numpy.int32)
+    bins = numpy.bincount((quantized[..., 0] * 64 + quantized[..., 1] * 8 + quantized[..., 2]).ravel(), minlength=512)
+    dominant = float(numpy.sort(bins)[-4:].sum() / bins.sum())
+
+    # Hasler and Suesstrunk colourfulness, scaled so vivid photos come out near 1
+    rg = red - green
+    yb = 0.5 * (red + green) - blue
+    colourfulness = math.sqrt(rg.std() ** 2 + yb.std() ** 2) + 0.3 * math.sqrt(rg.mean() ** 2 + yb.mean() ** 2)
+    colourfulness = min(1.0, colourfulness / 0.4)
+
+    resolution = min(1.0, math.sqrt(width * height / FULL_PIXELS))
+    aspect = math.exp(-1.5 * abs(math.log(width / height / IDEAL_ASPECT))) if width and height else 0.0
+    # Astronomy photos are mostly dark, bright frames tend to be charts or washed out
+    exposure = 1.0 - _clamp((brightness - 0.45) / 0.4)
+    sharpness = 1.0 - _clamp((edges - 0.06) / 0.2)
+    flatness = 1.0 - _clamp((dominant - 0.55) / 0.4)
+    tone = _clamp(contrast / 0.18)
+
+    score = resolution * aspect * (0.25 * exposure + 0.25 * sharpness + 0.25 * flatness + 0.15 * tone + 0.1 * colourfulness)
+    return {'score': score, 'brightness': brightness, 'contrast': min(1.0, contrast * 2),
+            'edges': min(1.0, edges * 4), 'colourfulness': colourfulness}
+
+
+
+def _clamp(value):
+    return max(0.0, min(1.0, value))
+
+
+
+#Scale 0-1 features to the 1-255 values the record store keeps
+def quantize(features):
+    return {name: 1 + round(features[name] * 254) for name in record_store.FEATURES}
+
+
+
+#RGB array of a QImage, scaled down to SCORE_WIDTH first if it is wider
+def image_array(image):
+    from PyQt5.QtCore import Qt
+    from PyQt5.QtGui import QImage
+
+    if image.width() > SCORE_WIDTH:
+        image = image.scaledToWidth(SCORE_WIDTH, Qt.SmoothTransformation)
+    image = image.convertToFormat(QImage.Format_RGB888)
+    width, height = image.width(), image.height()
+    bits = image.constBits()
+    bits.setsize(image.bytesPerLine() * height)
+    rows = numpy.frombuffer(bits, numpy.uint8).reshape(height, image.bytesPerLine())
+    return rows[:, :width * 3].reshape(height, width, 3).copy()
+
+
+
+#Features of a decoded image such as the window's preview, width and height are the original size
+def score_image(image, width, height):
+    return quantize(image_features(image_array(image), width, height))
+
+
+
+#Decode an image file at the scoring width and compute its features, None if it can't be decoded
+# Runs in the worker processes of score_cached, so it only needs QtGui, not a QApplication.
+def score_file(path):
+    from PyQt5.QtCore import QSize
+    from PyQt5.QtGui import QImageReader
+
+    reader = QImageReader(path)
+    size = reader.size()
+    if not size.isValid() or size.width() <= 0:
+        return None
+    if size.width() > SCORE_WIDTH:
+        reader.setScaledSize(QSize(SCORE_WIDTH, max(1, size.height() * SCORE_WIDTH // size.width())))
+    image = reader.read()
+    if image.isNull():
+        return None
+    return score_image(image, size.width(), size.height())
+
+
+
+#Path of the image to score for a date, the HD image when it is cached
+def _image_path(date):
+    found = get_apod.get_cached_image(date)
+    return None if found is None else found[0]
+
+
+
+#Score every cached image that hasn't been scored yet, spread over all CPU cores
+# The images are decoded and scored in worker processes, the results are written to the record
+# store here.  Returns the number of images scored.  progress(done, total) is called as they finish.
+def score_cached(workers=None, limit=None, progress=None):
+    store = record_store.get_store()
+    jobs = []
+    for day in store.unscored_days()[:limit]:
+        date = record_store.date_of(day)
+        path = _image_path(date)
+        if path is not None:
+            jobs.append((date, path))
+    if not jobs:
+        return 0
+
+    workers = workers or os.cpu_count() or 1
+    scored = 0
+    with instrument.stage("score_batch", images=len(jobs), workers=workers):
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            paths = [path for date, path in jobs]
+            chunksize = max(1, len(jobs) // (workers * 4))
+            for done, ((date, path), features) in enumerate(zip(jobs, executor.map(score_file, paths, chunksize=chunksize)), 1):
+                if features is not None:
+                    store.set_features(date, features)
+                    scored += 1
+                if progress is not None:
+                    progress(done, len(jobs))
+    store.flush()
+    return scored
@@ -0,0 +1,171 @@
+import sqlite3
+
+from PyQt5.QtWidgets import (QDialog, QVBoxLayout, QHBoxLayout, QLabel, QPushButton, QLineEdit,
+                             QCheckBox, QListWidget, QListWidgetItem)
+from PyQt5.QtCore import Qt, QObject, QRunnable, QThreadPool, QTimer, pyqtSignal
+
+import get_apod
+
+
+
+# Results listed for one query
+RESULT_LIMIT = 100
+# Wait this long after the last key press before searching
+TYPING_DELAY_MS = 200
+
+
+
+class SearchSyncSignals(QObject):
+    finished = pyqtSignal(int)
+    failed = pyqtSignal(str)
+
+
+
+#Bring the search index up to date in the background, the first run reads the whole metadata cache
+class SearchSyncTask(QRunnable):
+    def __init__(self):
+        super().__init__()
+        self.signals = SearchSyncSignals()
+
+    def run(self):
+        try:
+            added = get_apod.sync_search_index()
+        except (get_apod.ApodError, sqlite3.Error) as e:
+            self.signals.failed.emit(str(e))
+            return
+        self.signals.finished.emit(added)
+
+
+
+#Search the titles and explanations of the archive, double click a result to show that date
+class SearchDialog(QDialog):
+    date_selected = pyqtSignal(str)
+    wallpaper_requested = pyqtSignal(str)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle("Search APOD")
+        self.resize(760, 560)
+
+        self.thread_pool = QThreadPool(self)
+        self.syncing = False
+
+        self.query_edit = QLineEdit(self)
+        self.query_edit.setPlaceholderText("Saturn, M94, ring nebula...")
+        self.query_edit.textChanged.connect(self.query_changed)
+        self.images_only_check = QCheckBox("Images only", self)
+        self.images_only_check.setChecked(True)
+        self.images_only_check.toggled.connect(self.run_search)
+
+        self.typing_timer = QTimer(self)
+        self.typing_timer.setSingleShot(True)
+        self.typing_timer.setInterval(TYPING_DELAY_MS)
+        self.typing_timer.timeout.connect(self.run_search)
+
+        self.results_list = QListWidget(self)
+        self.results_list.setWordWrap(True)
+        self.results_list.itemDoubleClicked.connect(self.show_selected)
+        self.results_list.currentItemChanged.connect(self.selection_changed)
+
+        self.status_label = QLabel("")
+        self.show_button = QPushButton("Show")
+        self.show_button.clicked.connect(self.show_selected)
+        self.wallpaper_button = QPushButton("Set As Wallpaper")
+        self.wallpaper_button.clicked.connect(self.set_selected_wallpaper)
+        self.selection_changed(None)
+
+        search_layout = QHBoxLayout()
+        search_layout.addWidget(QLabel("Search:"))
+        search_layout.addWidget(self.query_edit, 1)
+        search_layout.addWidget(self.images_only_check)
+
+        buttons_layout = QHBoxLayout()
+        buttons_layout.addWidget(self.status_label, 1)
+        buttons_layout.addWidget(self.show_button)
+        buttons_layout.addWidget(self.wallpaper_button)
+
+        layout = QVBoxLayout()
+        layout.addLayout(search_layout)
+        layout.addWidget(self.results_list)
+        layout.addLayout(buttons_layout)
+        self.setLayout(layout)
+
+    def showEvent(self, event):
+        super().showEvent(event)
+        self.sync_index()
+        self.query_edit.setFocus()
+
+    #Index any dates published or fetched since the last sync
+    def sync_index(self):
+        if self.syncing:
+            return
+        self.syncing = True
+        self.status_label.setText("Updating the search index...")
+        task = SearchSyncTask()
+        task.signals.finished.connect(self.on_sync_finished)
+        task.signals.failed.connect(self.on_sync_failed)
+        self.thread_pool.start(task)
+
+    def on_sync_finished(self, added):
+        self.syncing = False
+        self.run_search()
+
+    def on_sync_failed(self, message):
+        self.syncing = False
+        self.run_search()
+        self.status_label.setText(f"Search index not updated: {message}")
+
+    def query_changed(self):
+        self.typing_timer.start()
+
+    def run_search(self):
+        query = self.query_edit.text().strip()
+        self.results_list.clear()
+        if not query:
+            self.status_label.setText("Updating the search index..." if self.syncing else "")
+            return
+
+        try:
+            results = get_apod.search_apod(query, RESULT_LIMIT, self.images_only_check.isChecked())
+        except sqlite3.Error as e:
+            self.status_label.setText(f"Search failed: {e}")
+            return
+
+        for result in results:
+            item = QListWidgetItem(f"{result['date']}  {result['title']}\n    {result['snippet']}")
+            item.setData(Qt.UserRole, result)
+            self.results_list.addItem(item)
+        status = f"{len(results)} results"
+        if self.syncing:
+            status += ", still updating the index"
+        self.status_label.setText(status)
+
+    #Image dates of the listed results, best match first, for the wallpaper rotation
+    def result_dates(self):
+        dates = []
+        for row in range(self.results_list.count()):
+            result = self.results_list.item(row).data(Qt.UserRole)
+            if result['media_type'] == 'image':
+                dates.append(result['date'])
+        return dates
+
+    def selection_changed(self, item, previous=None):
+        is_image = item is not None and item.data(Qt.UserRole)['media_type'] == 'image'
+        self.show_button.setEnabled(is_image)
+        self.wallpaper_button.setEnabled(is_image)
+
+    def selected_date(self):
+        item = self.results_list.currentItem()
+        if item is None or item.data(Qt.UserRole)['media_type'] != 'image':
+            return None
+        return item.data(Qt.UserRole)['date']
+
+    def show_selected(self):
+        date = self.selected_date()
+        if date is not None:
+            self.date_selected.emit(date)
+
+    def set_selected_wallpaper(self):
+        date = self.selected_date()
+        if date is not None:
+            self.wallpaper_requested.emit(date)
@@ -0,0 +1,138 @@
+import os
+import re
+import sqlite3
+import threading
+
+import apod_cache
+
+
+
+# Matches in the title count this many times more than matches in the explanation
+TITLE_WEIGHT = 10.0
+# Words of explanation shown around each match in a result
+SNIPPET_WORDS = 16
+
+
+
+def index_path():
+    return os.path.join(apod_cache.cache_dir(), "search.db")
+
+
+
+#Full text index of APOD titles and explanations in SQLite FTS5
+# Records are added as metadata is fetched or bulk synced.  Past entries never change, so a date
+# is only stored once.  Queries are ranked with bm25, matches in the title weigh the most.
+class SearchIndex:
+    def __init__(self, path=None):
+        self.path = path or index_path()
+        self.lock = threading.Lock()
+        self.db = None
+
+    def connect(self):
+        if self.db is not None:
+            return self.db
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        db = sqlite3.connect(self.path, check_same_thread=False)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        db.executescript("""
+            CREATE TABLE IF NOT EXISTS records (
+                id INTEGER PRIMARY KEY,
+                date TEXT UNIQUE NOT NULL,
+                media_type TEXT,
+                title TEXT,
+                explanation TEXT
+            );
+            CREATE VIRTUAL TABLE IF NOT EXISTS records_fts USING fts5(
+                title, explanation, content='records', content_rowid='id',
+                tokenize='porter unicode61'
+            );
+            CREATE TRIGGER IF NOT EXISTS records_added AFTER INSERT ON records BEGIN
+                INSERT INTO records_fts(rowid, title, explanation) VALUES (new.id, new.title, new.explanation);
+            END;
+            CREATE TABLE IF NOT EXISTS state (key TEXT PRIMARY KEY, value TEXT);
+        """)
+        self.db = db
+        return db
+
+    def close(self):
+        with self.lock:
+            if self.db is not None:
+                self.db.close()
+                self.db = None
+
+    #Add APOD metadata records, returns the number of dates that were new to the index
+    def add_records(self, records):
+        rows = [(data['date'], data.get('media_type'), data.get('title', ""), data.get('explanation', ""))
+                for data in records]
+        if not rows:
+            return 0
+        with self.lock:
+            db = self.connect()
+            with db:
+                # rowcount leaves out the changes the triggers make to the FTS table
+                cursor = db.executemany("INSERT OR IGNORE INTO records (date, media_type, title, explanation) "
+                                        "VALUES (?, ?, ?, ?)", rows)
+                return cursor.rowcount
+
+    def count(self):
+        with self.lock:
+            return self.connect().execute("SELECT COUNT(*) FROM records").fetchone()[0]
+
+    @property
+    def synced_through(self):
+        with self.lock:
+            row = self.connect().execute("SELECT value FROM state WHERE key = 'synced_through'").fetchone()
+        return row[0] if row else None
+
+    @synced_through.setter
+    def synced_through(self, date):
+        with self.lock:
+            db = self.connect()
+            with db:
+                db.execute("INSERT OR REPLACE INTO state (key, value) VALUES ('synced_through', ?)", (date,))
+
+    #Best matches for a query, as dicts with date, title, media_type and a snippet of the explanation
+    # Every word has to match, the last one also as a prefix so results come up while typing.
+    def search(self, query, limit=20, images_only=False):
+        match = fts_query(query)
+        if match is None:
+            return []
+        sql = (f"SELECT r.date, r.title, r.media_type, "
+               f"snippet(records_fts, 1, '[', ']', '...', {SNIPPET_WORDS}) "
+               f"FROM records_fts JOIN records r ON r.id = records_fts.rowid "
+               f"WHERE records_fts MATCH ?")
+        if images_only:
+            sql += " AND r.media_type = 'image'"
+        sql += f" ORDER BY bm25(records_fts, {TITLE_WEIGHT}, 1.0) LIMIT ?"
+        with self.lock:
+            rows = self.connect().execute(sql, (match, limit)).fetchall()
+        return [{'date': date, 'title': title, 'media_type': media_type, 'snippet': snippet}
+                for date, title, media_type, snippet in rows]
+
+
+
+#FTS5 query for plain words typed by a user, None if there is nothing to search for
+# Each word is quoted so characters like - or : are never read as query syntax.
+def fts_query(query):
+    words = re.findall(r"\w+", query)
+    if not words:
+        return None
+    terms = [f'"{word}"' for word in words]
+    terms[-1] += "*"
+    return " ".join(terms)
+
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+
+#The shared index stored in the cache folder
+def get_index():
+    global _index
+    with _index_lock:
+        if _index is None or _index.path != index_path():
+            _index = SearchIndex()
+        return _index
@@ -0,0 +1,40 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+import get_apod
+from fake_apod_server import FakeApodServer
+
+
+
+#Empty cache folder for one test, the record store and indexes follow it
+@pytest.fixture
+def cache_dir(tmp_path, monkeypatch):
+    monkeypatch.setenv("APOD_CACHE_DIR", str(tmp_path / "cache"))
+    return tmp_path / "cache"
+
+
+
+#fake_apod_server with the client pointed at it and a fresh quota and offline state
+@pytest.fixture
+def fake_server(cache_dir, monkeypatch):
+    monkeypatch.setattr(get_apod, "rate_limiter", get_apod.RateLimiter(1000))
+    api_base = get_apod.API_BASE
+    with FakeApodServer(image_size=(1200, 800), sd_size=(300, 200)) as server:
+        get_apod.set_api_base(server.api_base)
+        try:
+            yield server
+        finally:
+            get_apod.set_api_base(api_base)
+            get_apod._offline_until.clear()
+
+
+
+@pytest.fixture(scope="session")
+def qapp():
+    from PyQt5.QtWidgets import QApplication
+    return QApplication.instance() or QApplication([])
@@ -0,0 +1,52 @@
+import os
+import time
+
+import apod_cache
+import get_apod
+
+
+
+#Write an image of size bytes to the cache, last used age seconds ago
+def cached_file(name, size, age):
+    folder = os.path.join(apod_cache.cache_dir(), "images")
+    os.makedirs(folder, exist_ok=True)
+    path = os.path.join(folder, name)
+    with open(path, 'wb') as f:
+        f.write(b'x' * size)
+    used = time.time() - age
+    os.utime(path, (used, used))
+    return path
+
+
+
+def test_evict_removes_the_least_recently_used_first(cache_dir):
+    oldest = cached_file("a.jpg", 100, 30)
+    middle = cached_file("b.jpg", 100, 20)
+    newest = cached_file("c.jpg", 100, 10)
+
+    assert apod_cache.evict(250) == 1
+    assert not os.path.exists(oldest)
+    assert os.path.exists(middle) and os.path.exists(newest)
+
+
+
+def test_touch_and_keep_protect_a_file(cache_dir):
+    oldest = cached_file("a.jpg", 100, 30)
+    middle = cached_file("b.jpg", 100, 20)
+    newest = cached_file("c.jpg", 100, 10)
+    apod_cache.touch(oldest)
+
+    assert apod_cache.evict(200, keep=(middle,)) == 1
+    assert not os.path.exists(newest)
+    assert os.path.exists(oldest) and os.path.exists(middle)
+
+
+
+def test_downloads_stay_within_the_budget(fake_server, monkeypatch):
+    first = get_apod.get_image_file(get_apod.get_image_metadata("2020-01-05"))
+    monkeypatch.setenv("APOD_CACHE_MAX_MB", str(os.path.getsize(first) * 1.5 / (1024 * 1024)))
+    second = get_apod.get_image_file(get_apod.get_image_metadata("2020-01-06"))
+
+    assert os.path.exists(second)
+    assert not os.path.exists(first)
+    assert apod_cache.find_image("2020-01-05", first) is None
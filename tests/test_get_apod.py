@@ -0,0 +1,155 @@
+import os
+import socket
+import threading
+import time
+from datetime import datetime, timedelta
+
+import pytest
+
+import get_apod
+import image_index
+
+
+
+def test_rate_limiter_queues_then_refuses():
+    limiter = get_apod.RateLimiter(3600)
+    limiter.tokens = 2
+    limiter.acquire(max_wait=0)
+    limiter.acquire(max_wait=0)
+    with pytest.raises(get_apod.QuotaExceededError):
+        limiter.acquire(max_wait=0)
+    # One token a second at this limit
+    limiter.acquire(max_wait=2)
+
+
+
+def test_rate_limiter_keeps_the_reserve():
+    limiter = get_apod.RateLimiter(3600)
+    limiter.tokens = 3
+    limiter.acquire(reserve=2, max_wait=0)
+    with pytest.raises(get_apod.QuotaExceededError):
+        limiter.acquire(reserve=2, max_wait=0)
+    limiter.acquire(max_wait=0)
+
+
+
+def test_rate_limiter_follows_the_headers():
+    limiter = get_apod.RateLimiter(1000)
+    limiter.update({"X-RateLimit-Limit": "40", "X-RateLimit-Remaining": "0"})
+    assert limiter.limit == 40
+    with pytest.raises(get_apod.QuotaExceededError):
+        limiter.acquire(max_wait=0)
+
+
+
+def image_url(server):
+    return f"{server.url}/image/2020-01-05.png"
+
+
+
+def test_download_resumes_a_partial_file(fake_server, tmp_path):
+    data = fake_server.image(fake_server.image_size)
+    path = str(tmp_path / "image.png")
+    with open(path + ".part", 'wb') as f:
+        f.write(data[:len(data) // 3])
+
+    fake_server.reset_counters()
+    progress = []
+    get_apod.download_file(image_url(fake_server), path, lambda done, total: progress.append((done, total)))
+
+    with open(path, 'rb') as f:
+        assert f.read() == data
+    assert not os.path.exists(path + ".part")
+    assert fake_server.bytes_sent == len(data) - len(data) // 3
+    assert progress[-1] == (len(data), len(data))
+
+
+
+def test_download_restarts_when_the_partial_file_is_too_long(fake_server, tmp_path):
+    data = fake_server.image(fake_server.image_size)
+    path = str(tmp_path / "image.png")
+    with open(path + ".part", 'wb') as f:
+        f.write(b'x' * (len(data) + 10))
+
+    get_apod.download_file(image_url(fake_server), path)
+    with open(path, 'rb') as f:
+        assert f.read() == data
+
+
+
+def test_stalled_server_fails_fast_and_goes_offline(cache_dir, monkeypatch):
+    listener = socket.socket()
+    listener.bind(("127.0.0.1", 0))
+    listener.listen(8)
+    connections = []
+    threading.Thread(target=lambda: connections.append(listener.accept()), daemon=True).start()
+
+    monkeypatch.setattr(get_apod, "LOOKUP_READ_TIMEOUT", 0.5)
+    api_base = get_apod.API_BASE
+    get_apod.set_api_base(f"http://127.0.0.1:{listener.getsockname()[1]}/planetary/apod")
+    try:
+        start = time.monotonic()
+        with pytest.raises(get_apod.OfflineError):
+            get_apod.get_apod_metadata("2020-01-05")
+        assert time.monotonic() - start < 2
+        assert get_apod.is_offline(get_apod.API_BASE)
+
+        # Later requests don't touch the network until the host is retried
+        start = time.monotonic()
+        with pytest.raises(get_apod.OfflineError):
+            get_apod.get_apod_metadata("2020-01-06")
+        assert time.monotonic() - start < 0.1
+    finally:
+        get_apod.set_api_base(api_base)
+        get_apod._offline_until.clear()
+        listener.close()
+
+
+
+def test_metadata_is_fetched_once(fake_server):
+    first = get_apod.get_apod_metadata("2020-01-05")
+    fake_server.reset_counters()
+    assert get_apod.get_apod_metadata("2020-01-05") == first
+    assert fake_server.api_requests == 0
+
+
+
+def test_size_filters_match_after_probing(fake_server):
+    records = list(get_apod.get_apod_range("2020-01-01", "2020-01-10"))
+    images = [data for data in records if data['media_type'] == 'image']
+    assert image_index.get_index().unsized_dates() == [data['date'] for data in images]
+    assert get_apod.probe_image_sizes() == len(images)
+
+    date = get_apod.get_daily_image("random", min_width=1000, landscape=True)
+    assert "2020-01-01" <= date <= "2020-01-10"
+    assert get_apod.get_daily_image("random", min_width=5000) is not None
+
+
+
+def test_range_through_today_skips_an_unpublished_today(fake_server, monkeypatch):
+    today = datetime.today()
+    http_get = get_apod.http_get
+
+    def unpublished(url, **kwargs):
+        if today.strftime('%Y-%m-%d') in url:
+            raise get_apod.ApodError("No data available for that date.", 404)
+        return http_get(url, **kwargs)
+    monkeypatch.setattr(get_apod, "http_get", unpublished)
+
+    dates = [data['date'] for data in get_apod.get_apod_range(today - timedelta(days=5), today)]
+    assert dates == [(today - timedelta(days=days)).strftime('%Y-%m-%d') for days in range(5, 0, -1)]
+
+    monkeypatch.setattr(get_apod, "http_get", http_get)
+    dates = [data['date'] for data in get_apod.get_apod_range(today - timedelta(days=5), today)]
+    assert dates[-1] == today.strftime('%Y-%m-%d')
+    assert len(dates) == 6
+
+
+
+@pytest.mark.parametrize("date", ["1990-01-01", "2999-01-01", "2020-13-01", "yesterday"])
+def test_dates_outside_the_archive_are_api_errors(fake_server, date):
+    with pytest.raises(get_apod.ApodError) as raised:
+        get_apod.get_image_metadata(date)
+    assert raised.value.status_code == 400
+    assert not get_apod.is_unavailable(raised.value)
+    assert fake_server.api_requests == 0
@@ -0,0 +1,17 @@
+import pytest
+
+import image_index
+from fake_apod_server import synthetic_image
+
+
+
+@pytest.mark.parametrize("image_format", ["png", "jpg"])
+def test_image_size_from_the_header(qapp, image_format):
+    data = synthetic_image(123, 45, image_format)
+    assert image_index.image_size(data[:image_index.HEADER_BYTES]) == (123, 45)
+
+
+
+def test_image_size_of_a_gif_and_of_garbage():
+    assert image_index.image_size(b'GIF89a' + bytes([100, 0, 50, 0])) == (100, 50)
+    assert image_index.image_size(b'not an image') is None
@@ -0,0 +1,59 @@
+import os
+
+import apod
+import apod_cache
+import get_apod
+import image_store
+import record_store
+
+
+
+def write(path, data):
+    with open(path, 'wb') as f:
+        f.write(data)
+    return str(path)
+
+
+
+def test_identical_images_are_stored_once(cache_dir, tmp_path):
+    first = image_store.put(write(tmp_path / "a.jpg", b'same bytes'))
+    second = image_store.put(write(tmp_path / "b.jpg", b'same bytes'))
+    other = image_store.put(write(tmp_path / "c.jpg", b'other bytes'))
+
+    assert first == second
+    assert other != first
+    assert sorted(os.listdir(image_store.objects_dir())) == sorted({os.path.basename(first), os.path.basename(other)})
+
+
+
+def test_put_reuses_the_hash_taken_at_download(fake_server):
+    data = get_apod.get_image_metadata("2020-01-05")
+    path = get_apod.get_image_file(data)
+    hash_value = record_store.get_store().file_info("2020-01-05")[1]
+
+    assert os.path.basename(image_store.put(path, "2020-01-05")) == f"{hash_value:016x}.png"
+
+
+
+def test_current_path_only_changes_with_the_content(cache_dir, tmp_path):
+    first = image_store.set_current(write(tmp_path / "a.jpg", b'first'))
+    mtime = os.path.getmtime(first)
+    assert image_store.set_current(write(tmp_path / "b.jpg", b'first')) == first
+    assert os.path.getmtime(first) == mtime
+
+    second = image_store.set_current(write(tmp_path / "c.jpg", b'second'))
+    assert second != first
+    assert not os.path.exists(first)
+    with open(second, 'rb') as f:
+        assert f.read() == b'second'
+
+
+
+def test_cli_wallpaper_survives_cache_eviction(fake_server, capsys):
+    assert apod.main(["set-wallpaper", "--date", "2020-01-05", "--backend", "stub"]) == 0
+    path = capsys.readouterr().out.split("\t")[1]
+    assert os.path.dirname(path) == image_store.store_dir()
+
+    apod_cache.evict(0)
+    assert get_apod.find_image_file(get_apod.get_image_metadata("2020-01-05")) is None
+    assert os.path.isfile(path)
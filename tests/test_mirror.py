@@ -0,0 +1,73 @@
+import os
+
+import get_apod
+import mirror
+
+
+
+START, END = "2020-01-01", "2020-01-10"
+
+
+
+def images(start=START, end=END):
+    return [data for data in get_apod.get_apod_range(start, end) if data['media_type'] == 'image']
+
+
+
+def test_second_sync_skips_what_is_mirrored(fake_server, tmp_path):
+    folder = str(tmp_path / "mirror")
+    stats = mirror.sync_mirror(folder, START, END, workers=4)
+    expected = images()
+
+    assert stats.records == 10
+    assert stats.fetched == len(expected)
+    assert stats.failed == []
+    for data in expected:
+        path = os.path.join(folder, mirror.mirror_file(data['date'], get_apod.image_url(data)))
+        with open(path, 'rb') as f:
+            assert f.read() == fake_server.image(fake_server.image_size)
+
+    fake_server.reset_counters()
+    stats = mirror.sync_mirror(folder, START, END, workers=4)
+    assert (stats.fetched, stats.skipped) == (0, len(expected))
+    assert fake_server.image_requests == 0
+    assert len(mirror.Mirror(folder).manifest) == 10
+
+
+
+def test_verify_downloads_a_damaged_file_again(fake_server, tmp_path):
+    folder = str(tmp_path / "mirror")
+    mirror.sync_mirror(folder, START, END, workers=4)
+    data = images()[0]
+    path = os.path.join(folder, mirror.mirror_file(data['date'], get_apod.image_url(data)))
+
+    # Same size and mtime, so only hashing the file can tell
+    stat = os.stat(path)
+    with open(path, 'r+b') as f:
+        f.seek(stat.st_size // 2)
+        f.write(b'damaged')
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+
+    assert mirror.sync_mirror(folder, START, END, workers=4).fetched == 0
+    stats = mirror.sync_mirror(folder, START, END, workers=4, verify=True)
+    assert stats.fetched == 1
+    with open(path, 'rb') as f:
+        assert f.read() == fake_server.image(fake_server.image_size)
+
+
+
+def test_interrupted_download_is_resumed(fake_server, tmp_path):
+    folder = str(tmp_path / "mirror")
+    data = images(START, START)[0]
+    path = os.path.join(folder, mirror.mirror_file(data['date'], get_apod.image_url(data)))
+    image = fake_server.image(fake_server.image_size)
+    os.makedirs(os.path.dirname(path))
+    with open(path + ".part", 'wb') as f:
+        f.write(image[:len(image) // 2])
+
+    fake_server.reset_counters()
+    stats = mirror.sync_mirror(folder, START, START)
+    assert stats.fetched == 1
+    assert fake_server.bytes_sent == len(image) - len(image) // 2
+    with open(path, 'rb') as f:
+        assert f.read() == image
@@ -0,0 +1,82 @@
+from urllib.parse import urlparse
+
+import pytest
+
+import apod
+import get_apod
+from workers import ImageLoader
+
+
+
+# Every seventh day of the fake archive is a video, starting with this one
+VIDEO_DAY = "1995-06-22"
+
+
+
+def go_offline():
+    get_apod._set_offline(urlparse(get_apod.API_BASE).netloc, True)
+
+
+
+#Run an ImageLoader on this thread and return what it signalled
+def run_loader(date):
+    loader = ImageLoader(1, date)
+    results = []
+    loader.signals.finished.connect(lambda request_id, result: results.append(("finished", result)))
+    loader.signals.failed.connect(lambda request_id, message: results.append(("failed", message)))
+    loader.run()
+    assert len(results) == 1
+    return results[0]
+
+
+
+def test_errors_that_mean_nasa_is_unavailable():
+    assert get_apod.is_unavailable(get_apod.OfflineError("no route"))
+    assert get_apod.is_unavailable(get_apod.QuotaExceededError("quota", 429))
+    assert get_apod.is_unavailable(get_apod.ApodError("busy", 503))
+
+    assert not get_apod.is_unavailable(get_apod.NotAnImageError(f"The APOD for {VIDEO_DAY} is not an image."))
+    assert not get_apod.is_unavailable(get_apod.ApodError("bad date", 400))
+    assert not get_apod.is_unavailable(get_apod.ApodError("The API sent something that isn't JSON."))
+
+
+
+def test_offline_falls_back_to_the_closest_cached_image(fake_server):
+    data = get_apod.get_image_metadata("2020-01-05")
+    path = get_apod.get_image_file(data)
+    get_apod.get_image_file(get_apod.get_image_metadata("2019-06-01"))
+
+    go_offline()
+    assert apod.fetch_image("2020-01-08") == ("2020-01-05", path, data, True)
+
+
+
+def test_offline_loader_sends_the_cached_image_for_the_date_asked_for(fake_server, qapp):
+    get_apod.get_image_file(get_apod.get_image_metadata("2020-01-05"))
+
+    go_offline()
+    status, result = run_loader("2020-01-08")
+    assert status == "finished"
+    assert result.date == "2020-01-05"
+    assert result.requested == "2020-01-08"
+
+
+
+def test_video_day_is_not_taken_for_an_outage(fake_server, qapp):
+    get_apod.get_image_file(get_apod.get_image_metadata("1995-06-20"))
+
+    with pytest.raises(get_apod.NotAnImageError):
+        apod.fetch_image(VIDEO_DAY)
+    status, message = run_loader(VIDEO_DAY)
+    assert status == "failed"
+    assert "not an image" in message
+    assert apod.main(["fetch", "--date", VIDEO_DAY]) == 1
+
+
+
+def test_nothing_cached_while_offline_is_an_error(fake_server, qapp):
+    go_offline()
+    with pytest.raises(get_apod.OfflineError):
+        apod.fetch_image("2020-01-08")
+    status, message = run_loader("2020-01-08")
+    assert status == "failed"
@@ -0,0 +1,73 @@
+import pytest
+
+import record_store
+
+
+
+def record(date, media_type="image", hd=True):
+    data = {'date': date, 'media_type': media_type, 'title': f"APOD {date}", 'url': f"http://x/{date}_sd.jpg"}
+    if hd:
+        data['hdurl'] = f"http://x/{date}.jpg"
+    return data
+
+
+
+@pytest.fixture
+def store(cache_dir):
+    return record_store.RecordStore()
+
+
+
+def test_metadata_round_trip(store):
+    assert store.add_records([record("2020-01-05"), record("2020-01-06", "video")]) == 2
+    assert store.metadata("2020-01-05") == record("2020-01-05")
+    assert store.media_type("2020-01-06") == "video"
+    assert store.metadata("2020-01-07") is None
+
+
+
+def test_known_dates_are_not_replaced(store):
+    store.add_records([record("2020-01-05")])
+    changed = dict(record("2020-01-05"), title="Changed")
+    assert store.add_records([changed]) == 0
+    assert store.metadata("2020-01-05")['title'] == "APOD 2020-01-05"
+
+
+
+def test_image_filters(store):
+    store.add_records([record("2020-01-05"), record("2020-01-06"), record("2020-01-07", "video")])
+    store.set_size("2020-01-05", 1920, 1080)
+    store.set_size("2020-01-06", 800, 1200)
+    day = record_store.day_of
+
+    assert sorted(store.image_days()) == [day("2020-01-05"), day("2020-01-06")]
+    assert store.image_days(landscape=True) == [day("2020-01-05")]
+    assert store.image_days(min_width=1000) == [day("2020-01-05")]
+
+
+
+def test_features_and_cache_flags(store):
+    store.add_records([record("2020-01-05")])
+    features = dict.fromkeys(record_store.FEATURES, 200)
+    store.set_features("2020-01-05", features)
+    store.set_cached("2020-01-05", hd=True)
+
+    assert store.features("2020-01-05") == features
+    assert store.cached_days(True) == [record_store.day_of("2020-01-05")]
+    assert store.cached_days(False) == []
+    # Setting the cache state leaves the metadata alone
+    assert store.metadata("2020-01-05") == record("2020-01-05")
+
+
+
+def test_store_grows_and_reopens(store):
+    store.add_records([record("2020-01-05")])
+    store.set_size("2090-01-01", 640, 480)
+    store.synced_through = "2020-01-05"
+    store.flush()
+    store.close()
+
+    reopened = record_store.RecordStore()
+    assert reopened.metadata("2020-01-05") == record("2020-01-05")
+    assert reopened.size("2090-01-01") == (640, 480)
+    assert reopened.synced_through == "2020-01-05"
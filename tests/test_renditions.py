@@ -0,0 +1,98 @@
+import pytest
+from PyQt5.QtGui import QImage, QColor
+
+import get_apod
+import renditions
+from wallpaper import StubBackend, WallpaperError
+from workers import WallpaperTask
+
+
+
+DATE = "2020-01-05"
+
+
+
+class FailingBackend(StubBackend):
+    def set_wallpaper(self, path, span=False):
+        raise WallpaperError("The desktop said no.")
+
+
+
+@pytest.fixture
+def hd_image(fake_server, qapp):
+    return get_apod.get_image_file(get_apod.get_image_metadata(DATE))
+
+
+
+#Run a WallpaperTask on this thread and return what it signalled
+def run_task(backend, image_path, screens, fit_mode=renditions.FIT_FILL):
+    task = WallpaperTask(backend, image_path, DATE, screens, fit_mode)
+    results = []
+    task.signals.finished.connect(lambda path: results.append(("finished", path)))
+    task.signals.failed.connect(lambda message: results.append(("failed", message)))
+    task.run()
+    assert len(results) == 1
+    return results[0]
+
+
+
+def test_single_screen_gets_a_rendition_of_its_size(hd_image):
+    backend = StubBackend()
+    status, path = run_task(backend, hd_image, [(0, 0, 800, 600)])
+
+    assert status == "finished"
+    assert backend.calls == [(path, False)]
+    assert path != hd_image
+    assert QImage(path).size().width() == 800
+    assert QImage(path).size().height() == 600
+
+
+
+def test_fit_pads_with_black(hd_image):
+    status, path = run_task(StubBackend(), hd_image, [(0, 0, 600, 600)], renditions.FIT_FIT)
+
+    image = QImage(path)
+    assert (image.width(), image.height()) == (600, 600)
+    # A 3:2 image fitted into a square leaves bars above and below
+    assert QColor(image.pixel(300, 5)).value() < 16
+    assert QColor(image.pixel(300, 595)).value() < 16
+
+
+
+def test_several_screens_get_one_spanned_image(hd_image):
+    backend = StubBackend()
+    screens = [(0, 0, 800, 600), (800, -100, 1024, 768)]
+    status, path = run_task(backend, hd_image, screens)
+
+    assert backend.calls == [(path, True)]
+    image = QImage(path)
+    assert (image.width(), image.height()) == (1824, 768)
+
+
+
+def test_rendition_is_reused(hd_image, monkeypatch):
+    status, first = run_task(StubBackend(), hd_image, [(0, 0, 800, 600)])
+
+    def render(*args):
+        raise AssertionError("rendered again")
+    monkeypatch.setattr(renditions, "render", render)
+    status, second = run_task(StubBackend(), hd_image, [(0, 0, 800, 600)])
+    assert second == first
+
+
+
+def test_standard_resolution_rendition_is_not_reused_for_hd(fake_server, qapp):
+    data = get_apod.get_image_metadata(DATE)
+    sd_image = get_apod.get_image_file(data, hd=False)
+    status, sd_rendition = run_task(StubBackend(), sd_image, [(0, 0, 800, 600)])
+
+    hd_image = get_apod.get_image_file(data)
+    status, hd_rendition = run_task(StubBackend(), hd_image, [(0, 0, 800, 600)])
+    assert hd_rendition != sd_rendition
+
+
+
+def test_backend_failure_is_reported(hd_image):
+    status, message = run_task(FailingBackend(), hd_image, [(0, 0, 800, 600)])
+    assert status == "failed"
+    assert "said no" in message
@@ -0,0 +1,88 @@
+import time
+
+import pytest
+from PyQt5.QtCore import QThreadPool
+
+import rotation
+from rotation import Playlist, Rotation
+from wallpaper import StubBackend
+
+
+
+SCREENS = [(0, 0, 320, 240)]
+# Image days of the fake archive, 2020-01-02 is a video
+DATES = ["2020-01-03", "2020-01-04", "2020-01-05", "2020-01-06", "2020-01-07"]
+VIDEO_DAY = "2020-01-02"
+
+
+
+#Process events until condition() is true
+def wait_for(qapp, condition, timeout=10):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        qapp.processEvents()
+        time.sleep(0.01)
+
+
+
+@pytest.fixture
+def pool():
+    pool = QThreadPool()
+    yield pool
+    pool.waitForDone()
+
+
+
+@pytest.fixture
+def player(fake_server, qapp, pool):
+    player = Rotation(StubBackend(), pool)
+    player.switched_to = []
+    player.switched.connect(lambda date, title: player.switched_to.append(date))
+    yield player
+    player.stop()
+
+
+
+def test_buffer_fills_ahead_of_the_screen(player, qapp):
+    player.start(Playlist(DATES), SCREENS)
+    wait_for(qapp, lambda: len(player.buffer) == rotation.BUFFER_SIZE and player.switched_to)
+
+    assert player.switched_to == DATES[:1]
+    assert [wallpaper.date for wallpaper in player.buffer] == DATES[1:4]
+    assert len(player.backend.calls) == 1
+
+
+
+def test_advance_switches_from_the_buffer_and_refills(player, qapp):
+    player.start(Playlist(DATES), SCREENS)
+    wait_for(qapp, lambda: len(player.buffer) == rotation.BUFFER_SIZE and player.switched_to)
+
+    player.advance()
+    wait_for(qapp, lambda: len(player.buffer) == rotation.BUFFER_SIZE and len(player.switched_to) == 2)
+    assert player.switched_to == DATES[:2]
+    assert [wallpaper.date for wallpaper in player.buffer] == DATES[2:5]
+    assert len(player.backend.calls) == 2
+
+
+
+def test_playlist_without_images_gives_up(player, qapp):
+    messages = []
+    player.failed.connect(messages.append)
+    player.start(Playlist([VIDEO_DAY]), SCREENS)
+    wait_for(qapp, lambda: messages)
+
+    assert player.failures == rotation.MAX_FAILURES
+    assert not player.preparing
+    assert player.backend.calls == []
+
+
+
+def test_results_after_stop_are_dropped(player, qapp, pool):
+    player.start(Playlist(DATES), SCREENS)
+    player.stop()
+    pool.waitForDone()
+    qapp.processEvents()
+
+    assert not player.buffer
+    assert player.switched_to == []
@@ -0,0 +1,58 @@
+from datetime import datetime
+
+import pytest
+
+from scheduler import DailySchedule, RETRY_INTERVAL
+
+
+
+@pytest.fixture
+def schedule(cache_dir):
+    schedule = DailySchedule("09:00")
+    schedule.mark_applied(datetime(2024, 5, 10, 10, 0))
+    return schedule
+
+
+
+def test_not_due_until_the_next_update_time(schedule):
+    assert not schedule.is_due(datetime(2024, 5, 10, 23, 0))
+    assert not schedule.is_due(datetime(2024, 5, 11, 8, 59))
+    assert schedule.is_due(datetime(2024, 5, 11, 9, 0))
+
+
+
+def test_missed_updates_are_caught_up_once(schedule):
+    # Asleep through the 11th and 12th, woken before the update time on the 13th
+    now = datetime(2024, 5, 13, 8, 0)
+    assert schedule.next_day(now).isoformat() == "2024-05-12"
+    assert schedule.is_due(now)
+
+    schedule.mark_applied(now)
+    assert not schedule.is_due(datetime(2024, 5, 13, 8, 30))
+    assert schedule.next_run(now) == datetime(2024, 5, 13, 9, 0)
+
+
+
+def test_failed_update_is_retried_after_the_interval(schedule):
+    now = datetime(2024, 5, 11, 9, 0)
+    assert schedule.take("current", now) is None
+    assert not schedule.is_due(now + RETRY_INTERVAL / 2)
+    assert schedule.is_due(now + RETRY_INTERVAL)
+
+
+
+def test_current_mode_prefetches_only_near_the_update(schedule):
+    assert not schedule.prefetch_due("current", datetime(2024, 5, 11, 5, 0))
+    assert schedule.prefetch_due("current", datetime(2024, 5, 11, 6, 0))
+    assert schedule.prefetch_due("random", datetime(2024, 5, 10, 12, 0))
+
+
+
+def test_state_is_shared_through_the_file(schedule):
+    schedule.mark_applied(datetime(2024, 5, 11, 9, 30), stand_in="2024-05-11")
+
+    reloaded = DailySchedule()
+    assert reloaded.time == "09:00"
+    assert reloaded.stand_in == "2024-05-11"
+    assert not reloaded.is_due(datetime(2024, 5, 11, 12, 0))
+    assert reloaded.is_due(datetime(2024, 5, 12, 9, 0))
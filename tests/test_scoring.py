@@ -0,0 +1,24 @@
+import pytest
+
+import apod
+import get_apod
+import record_store
+
+pytest.importorskip("numpy")
+
+
+
+def test_score_command_scores_the_cached_images(fake_server, capsys):
+    for date in ("2020-01-05", "2020-01-06"):
+        get_apod.get_image_file(get_apod.get_image_metadata(date))
+
+    assert apod.main(["score", "--workers", "1"]) == 0
+    assert capsys.readouterr().out.startswith("2 images scored")
+    features = record_store.get_store().features("2020-01-05")
+    assert set(features) == set(record_store.FEATURES)
+
+    assert apod.main(["score"]) == 0
+    assert capsys.readouterr().out.startswith("0 images scored")
+
+    assert apod.main(["score", "--show", "2020-01-05"]) == 0
+    assert capsys.readouterr().out == f"2020-01-05 {features}\n"
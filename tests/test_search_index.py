@@ -0,0 +1,70 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+import get_apod
+import search_index
+
+
+
+def record(date, title, explanation, media_type="image"):
+    return {'date': date, 'title': title, 'explanation': explanation, 'media_type': media_type}
+
+
+
+@pytest.fixture
+def index(cache_dir):
+    index = search_index.SearchIndex()
+    index.add_records([
+        record("2020-01-01", "Saturn at Night", "The ringed planet rises over the hills."),
+        record("2020-01-02", "Orion Nebula", "Far behind the nebula a faint Saturn can be seen."),
+        record("2020-01-03", "Rings of Saturn", "A video flight through the rings.", "video"),
+        record("2020-01-04", "M94: The Cat's Eye Galaxy", "A spiral galaxy in Canes Venatici."),
+    ])
+    return index
+
+
+
+def test_new_records_are_counted_once(index):
+    assert index.count() == 4
+    added = index.add_records([record("2020-01-04", "Again", ""), record("2020-01-05", "New", ""),
+                               record("2020-01-06", "Newer", "")])
+    assert added == 2
+    assert index.count() == 6
+
+
+
+def test_title_matches_rank_first(index):
+    dates = [result['date'] for result in index.search("saturn")]
+    assert dates[-1] == "2020-01-02"
+    assert set(dates) == {"2020-01-01", "2020-01-02", "2020-01-03"}
+
+
+
+def test_images_only_and_snippets(index):
+    results = index.search("saturn", images_only=True)
+    assert [result['date'] for result in results][-1] == "2020-01-02"
+    assert "2020-01-03" not in [result['date'] for result in results]
+    assert "[Saturn]" in results[-1]['snippet']
+
+
+
+def test_last_word_matches_as_a_prefix_and_syntax_is_ignored(index):
+    assert [result['date'] for result in index.search("galax")] == ["2020-01-04"]
+    assert [result['date'] for result in index.search("M94: cat's")] == ["2020-01-04"]
+    assert index.search("- : *") == []
+
+
+
+def test_sync_fetches_the_archive_once(fake_server):
+    yesterday = datetime.today() - timedelta(days=1)
+    days = (yesterday - get_apod.APOD_START_DATE).days + 1
+
+    assert get_apod.sync_search_index() == days
+    assert search_index.get_index().synced_through == yesterday.strftime('%Y-%m-%d')
+
+    fake_server.reset_counters()
+    assert get_apod.sync_search_index() == 0
+    assert fake_server.api_requests == 0
+    results = get_apod.search_apod("synthetic 2020 01 05", limit=1)
+    assert results[0]['date'] == "2020-01-05"
@@ -0,0 +1,52 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from PyQt5.QtGui import QImageReader
+
+import apod_cache
+import get_apod
+import workers
+from fake_apod_server import synthetic_image
+from workers import decode_preview
+
+
+
+def test_concurrent_decodes_of_one_image(cache_dir, qapp, tmp_path):
+    path = str(tmp_path / "image.png")
+    with open(path, 'wb') as f:
+        f.write(synthetic_image(1600, 1000))
+
+    with ThreadPoolExecutor(8) as executor:
+        images = list(executor.map(lambda i: decode_preview(path, 400), range(16)))
+
+    assert all(image is not None and image.width() == 400 for image in images)
+    assert os.path.isfile(apod_cache.preview_path(path, 400))
+    assert not [name for name in os.listdir(tmp_path) if name.endswith(".tmp")]
+
+
+
+def test_preview_is_reused_when_the_date_is_shown_again(fake_server, qapp, monkeypatch):
+    decodes = []
+    monkeypatch.setattr(workers, "QImageReader", lambda path: decodes.append(path) or QImageReader(path))
+
+    for _ in range(2):
+        # Past the file system's timestamp granularity, so the LRU touch moves the mtime
+        time.sleep(0.05)
+        data = get_apod.get_image_metadata("2020-01-05")
+        assert decode_preview(get_apod.get_image_file(data), 400).width() == 400
+    assert len(decodes) == 1
+
+
+
+def test_preview_is_made_again_for_a_new_download(cache_dir, qapp, tmp_path):
+    path = str(tmp_path / "image.png")
+    with open(path, 'wb') as f:
+        f.write(synthetic_image(1600, 1000))
+    decode_preview(path, 400)
+
+    # Downloads are renamed into place, so the new file is a new inode
+    with open(path + ".part", 'wb') as f:
+        f.write(synthetic_image(800, 800))
+    os.replace(path + ".part", path)
+    assert decode_preview(path, 400).height() == 400
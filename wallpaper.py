@@ -0,0 +1,94 @@
+import os
+import sys
+import subprocess
+from pathlib import Path
+
+
+
+class WallpaperError(Exception):
+    pass
+
+
+
+#Base class for the platform specific ways of changing the desktop wallpaper
+# span is True when the image covers the whole virtual desktop across several screens
+class WallpaperBackend:
+    name = "base"
+
+    def set_wallpaper(self, path, span=False):
+        raise NotImplementedError
+
+
+
+class WindowsBackend(WallpaperBackend):
+    name = "windows"
+
+    SPI_SETDESKWALLPAPER = 20
+    SPIF_UPDATEINIFILE_SENDCHANGE = 3
+    # WallpaperStyle value that stretches one image across all monitors
+    STYLE_SPAN = "22"
+
+    def set_wallpaper(self, path, span=False):
+        import ctypes
+
+        if span:
+            import winreg
+            with winreg.OpenKey(winreg.HKEY_CURRENT_USER, r"Control Panel\Desktop", 0, winreg.KEY_SET_VALUE) as key:
+                winreg.SetValueEx(key, "WallpaperStyle", 0, winreg.REG_SZ, self.STYLE_SPAN)
+                winreg.SetValueEx(key, "TileWallpaper", 0, winreg.REG_SZ, "0")
+
+        # Set the wallpaper using the Windows API
+        if not ctypes.windll.user32.SystemParametersInfoW(self.SPI_SETDESKWALLPAPER, 0, path,
+                                                          self.SPIF_UPDATEINIFILE_SENDCHANGE):
+            raise WallpaperError("Windows refused to change the wallpaper.")
+
+
+
+#GNOME and other desktops using the org.gnome.desktop.background settings
+class GnomeBackend(WallpaperBackend):
+    name = "gnome"
+
+    def set_wallpaper(self, path, span=False):
+        uri = Path(os.path.abspath(path)).as_uri()
+        options = "spanned" if span else "zoom"
+        try:
+            self._gsettings("picture-uri", uri)
+            self._gsettings("picture-options", options)
+            # picture-uri-dark only exists on GNOME 42 and later
+            self._gsettings("picture-uri-dark", uri, check=False)
+        except (OSError, subprocess.SubprocessError) as e:
+            raise WallpaperError(f"gsettings failed: {e}")
+
+    def _gsettings(self, key, value, check=True):
+        subprocess.run(["gsettings", "set", "org.gnome.desktop.background", key, value],
+                       check=check, capture_output=True, timeout=10)
+
+
+
+#Records the calls instead of changing anything, for headless runs and testing
+class StubBackend(WallpaperBackend):
+    name = "stub"
+
+    def __init__(self):
+        self.calls = []
+
+    def set_wallpaper(self, path, span=False):
+        if not os.path.exists(path):
+            raise WallpaperError(f"{path} does not exist.")
+        self.calls.append((path, span))
+
+
+
+BACKENDS = {backend.name: backend for backend in (WindowsBackend, GnomeBackend, StubBackend)}
+
+
+
+#Pick the backend from APOD_WALLPAPER_BACKEND, otherwise from the platform
+def get_backend(name=None):
+    name = name or os.getenv("APOD_WALLPAPER_BACKEND")
+    if not name:
+        name = "windows" if sys.platform == "win32" else "gnome"
+    try:
+        return BACKENDS[name]()
+    except KeyError:
+        raise WallpaperError(f"Unknown wallpaper backend '{name}'.")
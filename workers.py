@@ -0,0 +1,291 @@
+import os
+import tempfile
+from datetime import datetime
+
+from PyQt5.QtCore import Qt, QObject, QRunnable, QSize, pyqtSignal
+from PyQt5.QtGui import QImage, QImageReader
+
+import apod_cache
+import get_apod
+import image_index
+import image_store
+import instrument
+import record_store
+import renditions
+from wallpaper import WallpaperError
+
+# Scoring needs numpy, without it images are simply left unscored
+try:
+    import scoring
+except ImportError:
+    scoring = None
+
+
+
+# Width of the preview shown in the main window
+PREVIEW_WIDTH = 780
+
+
+
+#Everything the window needs once an image has been loaded
+class ImageResult:
+    def __init__(self, date, image_path, title, caption, preview, set_wallpaper, hd=True, daily=False, requested=None):
+        self.date = date
+        self.image_path = image_path
+        self.title = title
+        self.caption = caption
+        self.preview = preview
+        self.set_wallpaper = set_wallpaper
+        self.hd = hd
+        self.daily = daily
+        # Set to the date asked for when NASA couldn't be reached and a cached image stands in
+        self.requested = requested
+
+
+
+#QRunnable can't emit signals itself, so the signals live on a QObject created in the GUI thread
+class ImageLoaderSignals(QObject):
+    preview_ready = pyqtSignal(int, object)
+    finished = pyqtSignal(int, object)
+    failed = pyqtSignal(int, str)
+    progress = pyqtSignal(int, object, object)
+
+
+
+#Fetch, decode and scale an APOD image on a thread pool thread
+# Only QImage is used here, the window turns the preview into a QPixmap on the GUI thread.
+# Each loader carries the request id it was started with so the window can drop stale results.
+# In progressive mode the standard resolution image is loaded and sent with preview_ready
+# first, then the HD image is downloaded and sent with finished.  daily marks the scheduled
+# update, as opposed to a wallpaper the user picked.  When NASA can't be reached the best
+# cached image is sent instead, with requested set on the result.
+class ImageLoader(QRunnable):
+    def __init__(self, request_id, date, set_wallpaper=False, progressive=False, daily_mode=None, daily=False):
+        super().__init__()
+        self.request_id = request_id
+        self.date = date
+        self.daily_mode = daily_mode
+        self.set_wallpaper = set_wallpaper
+        self.daily = daily
+        self.progressive = progressive
+        self.cancelled = False
+        self.signals = ImageLoaderSignals()
+
+    #Stop after the current stage, a cancelled loader never emits
+    def cancel(self):
+        self.cancelled = True
+
+    #Download progress in bytes, total is None when the size isn't known
+    def report_progress(self, done, total):
+        if not self.cancelled:
+            self.signals.progress.emit(self.request_id, done, total)
+
+    def run(self):
+        try:
+            self.load()
+        except get_apod.ApodError as e:
+            if not (get_apod.is_unavailable(e) and self.load_cached()):
+                self.fail(str(e))
+        except Exception as e:
+            self.fail(f"Unexpected error: {e}")
+
+    def fail(self, message):
+        if not self.cancelled:
+            self.signals.failed.emit(self.request_id, message)
+
+    #Send the best cached image in place of the one asked for, False if nothing is cached
+    def load_cached(self):
+        found = get_apod.find_cached_image(self.date, self.daily_mode or "current")
+        if found is None or self.cancelled:
+            return False
+        date, path, data = found
+        preview = decode_preview(path)
+        if preview is None:
+            return False
+        if not self.cancelled:
+            requested = self.date or datetime.today().strftime('%Y-%m-%d')
+            result = ImageResult(date, self.store(path, date), data['title'], data['explanation'], preview,
+                                 self.set_wallpaper, daily=self.daily, requested=requested)
+            self.signals.finished.emit(self.request_id, result)
+        return True
+
+    #Put the image in the content-addressed store, the window shows and renders the stored file
+    def store(self, image_path, date):
+        with instrument.stage("store", date=date, bytes=os.path.getsize(image_path)):
+            return image_store.put(image_path, date)
+
+    #Score the image from its preview while it is decoded anyway, for the random mode weighting
+    def score(self, image_path, preview):
+        store = record_store.get_store()
+        if scoring is None or store.features(self.date) is not None:
+            return
+        size = image_index.image_file_size(image_path)
+        if size is None:
+            return
+        with instrument.stage("score", date=self.date):
+            store.set_features(self.date, scoring.score_image(preview, *size))
+
+    def load(self):
+        if self.date is None:
+            self.date = get_apod.get_daily_image(self.daily_mode)
+        data = get_apod.get_image_metadata(self.date)
+        if self.cancelled:
+            return
+
+        # Nothing to gain from a preview when the HD image is already cached
+        if (self.progressive and get_apod.has_hd_image(data)
+                and get_apod.find_image_file(data) is None):
+            sd_path = get_apod.get_image_file(data, hd=False)
+            if self.cancelled:
+                return
+            preview = decode_preview(sd_path)
+            if preview is not None and not self.cancelled:
+                result = ImageResult(self.date, sd_path, data['title'], data['explanation'],
+                                     preview, self.set_wallpaper, hd=False, daily=self.daily)
+                self.signals.preview_ready.emit(self.request_id, result)
+
+        image_path = get_apod.get_image_file(data, self.report_progress)
+        if self.cancelled:
+            return
+
+        preview = decode_preview(image_path)
+        if preview is None:
+            self.fail("The downloaded image could not be decoded.")
+            return
+        if self.cancelled:
+            return
+        self.score(image_path, preview)
+
+        result = ImageResult(self.date, self.store(image_path, self.date), data['title'], data['explanation'],
+                             preview, self.set_wallpaper, daily=self.daily)
+        self.signals.finished.emit(self.request_id, result)
+
+
+
+#Decode an image file straight at the preview width, None if it can't be decoded
+# QImageReader decodes at the scaled size (for JPEG the downscale happens in the DCT domain),
+# so the full resolution image is never held in memory.  The result is cached next to the
+# original and reused until the image is downloaded again, see apod_cache.preview_path.
+def decode_preview(path, width=PREVIEW_WIDTH):
+    cached_path = apod_cache.preview_path(path, width)
+    if os.path.exists(cached_path):
+        with instrument.stage("decode", cached=True):
+            image = QImage(cached_path)
+        if not image.isNull():
+            instrument.count("preview_cache_hit")
+            apod_cache.touch(cached_path)
+            return image
+    instrument.count("preview_cache_miss")
+
+    with instrument.stage("decode", cached=False) as timer:
+        reader = QImageReader(path)
+        reader.setAutoTransform(True)
+        size = reader.size()
+        timer.set(width=size.width(), height=size.height())
+        if size.isValid() and size.width() > width:
+            reader.setScaledSize(QSize(width, max(1, round(size.height() * width / size.width()))))
+
+        image = reader.read()
+        if image.isNull():
+            return None
+        # Images narrower than the preview are scaled up as before, which is cheap
+        if image.width() < width:
+            image = image.scaledToWidth(width, Qt.SmoothTransformation)
+
+    # Two loaders can decode the same image at once, so each writes its own temp file
+    with instrument.stage("save_preview"):
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(cached_path), suffix=".tmp")
+        os.close(fd)
+        if image.save(tmp_path, "JPG", 90):
+            os.replace(tmp_path, cached_path)
+        else:
+            os.remove(tmp_path)
+    return image
+
+
+
+class WallpaperSignals(QObject):
+    finished = pyqtSignal(str)
+    failed = pyqtSignal(str)
+
+
+
+#Render the screen-fitted wallpaper and hand it to the wallpaper backend on a thread pool thread
+# screens comes from renditions.screen_geometries(), which has to be called on the GUI thread
+class WallpaperTask(QRunnable):
+    def __init__(self, backend, image_path, date, screens, fit_mode=renditions.FIT_FILL):
+        super().__init__()
+        self.backend = backend
+        self.image_path = image_path
+        self.date = date
+        self.screens = screens
+        self.fit_mode = fit_mode
+        self.signals = WallpaperSignals()
+
+    def run(self):
+        try:
+            with instrument.stage("render", date=self.date, screens=len(self.screens), fit=self.fit_mode):
+                path, span = renditions.prepare_wallpaper(self.image_path, self.date, self.screens, self.fit_mode)
+            if path is None:
+                self.signals.failed.emit("The image could not be prepared for the screen.")
+                return
+            with instrument.stage("store", date=self.date):
+                path = image_store.set_current(path)
+            with instrument.stage("set_wallpaper", backend=self.backend.name, span=span):
+                self.backend.set_wallpaper(path, span)
+        except (WallpaperError, OSError) as e:
+            self.signals.failed.emit(str(e))
+            return
+        self.signals.finished.emit(path)
+
+
+
+class RevalidateSignals(QObject):
+    finished = pyqtSignal(str)
+    failed = pyqtSignal(str, bool)
+
+
+
+#Fetch a date that was served from the cache while NASA was unreachable, once it can be reached
+# failed carries whether it is worth trying again, a video or a bad date never will be.
+class RevalidateTask(QRunnable):
+    def __init__(self, date):
+        super().__init__()
+        self.date = date
+        self.signals = RevalidateSignals()
+
+    def run(self):
+        try:
+            data = get_apod.get_image_metadata(self.date)
+            get_apod.get_image_file(data)
+        except get_apod.ApodError as e:
+            self.signals.failed.emit(str(e), get_apod.is_unavailable(e))
+            return
+        except OSError as e:
+            self.signals.failed.emit(str(e), True)
+            return
+        self.signals.finished.emit(self.date)
+
+
+
+class PrefetchSignals(QObject):
+    finished = pyqtSignal(str)
+    failed = pyqtSignal(str)
+
+
+
+#Fetch the pick for the next daily update into the cache ahead of time
+class PrefetchTask(QRunnable):
+    def __init__(self, schedule, mode):
+        super().__init__()
+        self.schedule = schedule
+        self.mode = mode
+        self.signals = PrefetchSignals()
+
+    def run(self):
+        try:
+            date = self.schedule.prefetch(self.mode)
+        except (get_apod.ApodError, OSError) as e:
+            self.signals.failed.emit(str(e))
+            return
+        self.signals.finished.emit(date)